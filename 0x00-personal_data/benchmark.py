@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for filtered_logger.
+
+Run it from this directory:
+
+    ./benchmark.py [--lines N] [--only NAME,...] [--output results.json]
+                   [--compare previous.json]
+
+Every benchmark prints a table and adds machine-readable records to
+the results written by --output; --compare prints the ratio of each
+metric to a previous results file, e.g. one from the last release.
+
+The "synthetic" benchmark redacts generated key=value; lines of
+varying sizes, field counts and PII densities, measuring lines/sec and
+the memory allocated per line with tracemalloc. "formatter" measures
+the end-to-end cost of logging a line through RedactingFormatter, and
+"export" the rows/sec of export_users against a SQLite users table.
+
+The other benchmarks follow the history of the module. "legacy"
+reports how many log lines per second filter_datum redacts with
+1, 5 and 50 fields, next to the original implementation which rebuilt
+the pattern on every call; "engines" races the regex and scanning
+engines over growing field lists to show where filter_datum should
+switch from one to the other (SCAN_ENGINE_MIN_FIELDS).
+
+"get_logger" times repeated get_logger calls on the configured
+"user_data" logger; main_logger.py checks that they configure it only
+once.
+
+"handlers" compares logging through three handlers with the original
+formatter, which redacted record.msg in every handler, and with
+RedactingFormatter, which redacts each record once.
+
+"hashing" hashes a batch of passwords with hash_many on 1, 2, 4, ...
+threads up to the number of cores, at a bcrypt cost calibrated for
+--hash-budget-ms, to show how it scales.
+
+"pool" measures the latency of acquiring a connection with and
+without ConnectionPool, against a SQLite stand-in for MySQL whose
+connect() sleeps --handshake-ms to mimic the TCP and auth handshake.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import re
+import sqlite3
+import string
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import filtered_logger
+from filtered_logger import (
+    PII_FIELDS, SCAN_ENGINE_MIN_FIELDS, ConnectionPool, RedactingFormatter,
+    _regex_redactor, _scan_redactor, export_users, filter_datum, get_logger
+)
+
+FIELD_COUNTS = (1, 5, 50)
+ENGINE_FIELD_COUNTS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+SYNTHETIC_SIZES = (64, 256, 1024)
+SYNTHETIC_FIELD_COUNTS = (5, 50, 500)
+SYNTHETIC_DENSITIES = (0.0, 0.2, 0.8)
+REDACTION = "***"
+SEPARATOR = ";"
+
+
+def record(results: List[Dict], benchmark: str, params: Dict,
+           **metrics: float) -> None:
+    """
+    Adds one machine-readable measurement to the results.
+    """
+    results.append({"benchmark": benchmark, "params": params,
+                    "metrics": metrics})
+
+
+def legacy_filter_datum(fields: List[str], redaction: str,
+                        message: str, separator: str) -> str:
+    """
+    The original filter_datum, kept as the baseline of the benchmark.
+    """
+    pattern = '|'.join([
+        f'{field}=[^{separator}]*' for field in fields
+    ])
+    return re.sub(
+        pattern,
+        lambda m: m.group().split('=')[0] + '=' + redaction,
+        message
+    )
+
+
+def make_fields(count: int) -> List[str]:
+    """
+    Builds `count` field names, starting with the usual PII fields.
+    """
+    base = ["name", "email", "phone", "ssn", "password"]
+    return (base + ["field{}".format(i) for i in range(count)])[:count]
+
+
+def make_line(fields: List[str]) -> str:
+    """
+    Builds a log line holding every field plus a few non PII ones.
+    """
+    pairs = ["{}=value_of_{}".format(f, f) for f in fields]
+    pairs += ["ip=10.0.0.1", "user_agent=Mozilla/5.0", "last_login=now"]
+    return SEPARATOR.join(pairs) + SEPARATOR
+
+
+def make_request_line(fields: List[str]) -> str:
+    """
+    Builds a typical request log line: the five usual PII fields (when
+    they are part of `fields`) among a handful of non PII ones.
+    """
+    pairs = ["{}=value_of_{}".format(f, f) for f in fields[:5]]
+    pairs += ["ip=10.0.0.1", "user_agent=Mozilla/5.0", "last_login=now",
+              "path=/api/v1/users", "status=200", "duration_ms=12"]
+    return SEPARATOR.join(pairs) + SEPARATOR
+
+
+def synthetic_lines(count: int, size: int, fields: List[str],
+                    density: float, seed: int = 0) -> List[str]:
+    """
+    Generates `count` key=value; lines of about `size` characters in
+    which a `density` fraction of the keys are PII fields.
+    """
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + "@.-_ "
+    lines = []
+    for _ in range(count):
+        pairs: List[str] = []
+        length = 0
+        while length < size:
+            if rng.random() < density:
+                key = rng.choice(fields)
+            else:
+                key = "attr{}".format(rng.randrange(100))
+            value = "".join(rng.choices(alphabet, k=rng.randint(4, 24)))
+            pairs.append("{}={}".format(key, value))
+            length += len(pairs[-1]) + 1
+        lines.append(SEPARATOR.join(pairs) + SEPARATOR)
+    return lines
+
+
+def rate(func: Callable[[str], str], lines: List[str], total: int) -> float:
+    """
+    Calls `func` on `total` lines cycling through `lines` and returns
+    the achieved lines/sec.
+    """
+    rounds, rest = divmod(total, len(lines))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for line in lines:
+            func(line)
+    for line in lines[:rest]:
+        func(line)
+    return total / (time.perf_counter() - start)
+
+
+def allocated_per_line(func: Callable[[str], str],
+                       lines: List[str]) -> float:
+    """
+    Returns the peak memory allocated while redacting one line, in
+    bytes, averaged over `lines` (tracemalloc).
+    """
+    peaks = 0
+    tracemalloc.start()
+    try:
+        for line in lines:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            func(line)
+            peaks += tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return peaks / len(lines)
+
+
+def bench_synthetic(results: List[Dict], lines: int) -> None:
+    """
+    Redacts synthetic lines across sizes, field counts and densities.
+    """
+    print("{:>6} {:>7} {:>8} {:>12} {:>12}".format(
+        "size", "fields", "density", "lines/sec", "bytes/line"))
+    for size in SYNTHETIC_SIZES:
+        for count in SYNTHETIC_FIELD_COUNTS:
+            fields = tuple(make_fields(count))
+            for density in SYNTHETIC_DENSITIES:
+                sample = synthetic_lines(200, size, fields, density)
+
+                def redact(line: str) -> str:
+                    """ Redact one line the way the formatter does """
+                    return filter_datum(fields, REDACTION, line, SEPARATOR)
+
+                per_sec = rate(redact, sample, lines)
+                allocated = allocated_per_line(redact, sample)
+                print("{:>6} {:>7} {:>8.1f} {:>12,.0f} {:>12,.0f}".format(
+                    size, count, density, per_sec, allocated))
+                record(results, "synthetic",
+                       {"size": size, "fields": count, "density": density},
+                       lines_per_sec=per_sec, bytes_per_line=allocated)
+
+
+def bench_formatter(results: List[Dict], lines: int) -> None:
+    """
+    Measures the end-to-end cost of logging a line through a
+    RedactingFormatter handler, from logger.info to the stream.
+    """
+    logger = logging.getLogger("benchmark_formatter")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = logging.StreamHandler(io.StringIO())
+    handler.setFormatter(RedactingFormatter(list(PII_FIELDS)))
+    logger.addHandler(handler)
+    sample = synthetic_lines(200, 256, list(PII_FIELDS), 0.2)
+
+    per_sec = rate(logger.info, sample, lines)
+    allocated = allocated_per_line(logger.info, sample)
+    print("\nformatter: {:,.0f} lines/sec, {:.2f} us/line, "
+          "{:,.0f} bytes/line".format(per_sec, 1e6 / per_sec, allocated))
+    record(results, "formatter", {"size": 256, "density": 0.2},
+           lines_per_sec=per_sec, bytes_per_line=allocated)
+
+
+def bench_export(results: List[Dict], rows: int) -> None:
+    """
+    Exports a SQLite users table with export_users, the logger writing
+    to memory, and reports rows/sec.
+    """
+    def get_db() -> sqlite3.Connection:
+        """ A SQLite stand-in for the MySQL users table """
+        db = sqlite3.connect(":memory:")
+        db.execute("CREATE TABLE users (name, email, phone, ssn, "
+                   "password, ip, last_login, user_agent)")
+        db.executemany(
+            "INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (("user{}".format(i), "user{}@example.com".format(i),
+              "555-0100", "000-00-0000", "pw", "10.0.0.1",
+              "2019-11-14 06:14:24", "Mozilla/5.0") for i in range(rows))
+        )
+        return db
+
+    original_get_db = filtered_logger.get_db
+    filtered_logger.get_db = get_db
+    logger = get_logger()
+    logger.handlers[0].setStream(io.StringIO())
+    try:
+        exported, elapsed = export_users()
+    finally:
+        filtered_logger.get_db = original_get_db
+    print("\nexport: {:,} rows, {:,.0f} rows/sec".format(
+        exported, exported / elapsed))
+    record(results, "export", {"rows": rows},
+           rows_per_sec=exported / elapsed)
+
+
+def bench_legacy(results: List[Dict], lines: int) -> None:
+    """
+    Compares the legacy and cached filter_datum implementations.
+    """
+    print("\n{:>7} {:>14} {:>14} {:>8}".format(
+        "fields", "before l/s", "after l/s", "speedup"))
+    for count in FIELD_COUNTS:
+        fields = make_fields(count)
+        line = make_line(fields)
+        assert filter_datum(fields, REDACTION, line, SEPARATOR) == \
+            legacy_filter_datum(fields, REDACTION, line, SEPARATOR)
+        before = rate(lambda message: legacy_filter_datum(
+            fields, REDACTION, message, SEPARATOR), [line], lines)
+        after = rate(lambda message: filter_datum(
+            fields, REDACTION, message, SEPARATOR), [line], lines)
+        print("{:>7} {:>14,.0f} {:>14,.0f} {:>7.2f}x".format(
+            count, before, after, after / before))
+        record(results, "legacy", {"fields": count},
+               before_lines_per_sec=before, lines_per_sec=after)
+
+
+def bench_engines(results: List[Dict], lines: int) -> None:
+    """
+    Races the regex and scanning engines and reports the crossover.
+    """
+    print("\n{:>7} {:>14} {:>14}  {}".format(
+        "fields", "regex l/s", "scan l/s", "faster"))
+    crossover = None
+    for count in ENGINE_FIELD_COUNTS:
+        fields = tuple(make_fields(count))
+        line = make_request_line(list(fields))
+        regex = _regex_redactor(fields, REDACTION, SEPARATOR)
+        scan = _scan_redactor(fields, REDACTION, SEPARATOR)
+        assert regex(line) == scan(line)
+        regex_rate = rate(regex, [line], lines)
+        scan_rate = rate(scan, [line], lines)
+        faster = "scan" if scan_rate > regex_rate else "regex"
+        if faster == "scan" and crossover is None:
+            crossover = count
+        print("{:>7} {:>14,.0f} {:>14,.0f}  {}".format(
+            count, regex_rate, scan_rate, faster))
+        record(results, "engines", {"fields": count},
+               regex_lines_per_sec=regex_rate, scan_lines_per_sec=scan_rate)
+    print("crossover: {} fields (SCAN_ENGINE_MIN_FIELDS = {})".format(
+        crossover, SCAN_ENGINE_MIN_FIELDS))
+
+
+def bench_get_logger(results: List[Dict], calls: int) -> None:
+    """
+    Calls get_logger `calls` times, logs one line and reports how many
+    times it was formatted and written.
+    """
+    logger = get_logger()
+    stream = io.StringIO()
+    logger.handlers[0].setStream(stream)
+    formats = []
+    original_format = RedactingFormatter.format
+
+    def counting_format(self, record):
+        """ Count the calls of RedactingFormatter.format """
+        formats.append(record)
+        return original_format(self, record)
+
+    RedactingFormatter.format = counting_format
+    try:
+        start = time.perf_counter()
+        for _ in range(calls):
+            logger = get_logger()
+        elapsed = time.perf_counter() - start
+        logger.info("name=Bob;email=bob@dylan.com;ip=10.0.0.1;")
+    finally:
+        RedactingFormatter.format = original_format
+
+    print("\nget_logger x{}: {:.2f} us/call, {} handler(s), {} format(s), "
+          "{} line(s) written".format(
+              calls, elapsed / calls * 1e6, len(logger.handlers),
+              len(formats), len(stream.getvalue().splitlines())))
+    record(results, "get_logger", {"calls": calls},
+           us_per_call=elapsed / calls * 1e6, handlers=len(logger.handlers))
+
+
+class LegacyRedactingFormatter(RedactingFormatter):
+    """ The original RedactingFormatter, redacting in every handler
+    """
+
+    def format(self, record):
+        """ Overwrite record.msg with its redacted value, then format """
+        record.msg = filter_datum(
+            self.fields, self.REDACTION, record.msg, self.SEPARATOR
+        )
+        return logging.Formatter.format(self, record)
+
+
+def bench_handlers(results: List[Dict], lines: int,
+                   handlers: int = 3) -> None:
+    """
+    Logs through `handlers` redacting handlers with both formatters.
+    """
+    line = make_request_line(make_fields(5))
+    print("\nlogging through {} handlers:".format(handlers))
+    rates = []
+    for formatter_class in (LegacyRedactingFormatter, RedactingFormatter):
+        logger = logging.getLogger("benchmark_" + formatter_class.__name__)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        for _ in range(handlers):
+            handler = logging.StreamHandler(io.StringIO())
+            handler.setFormatter(formatter_class(make_fields(5)))
+            logger.addHandler(handler)
+        rates.append(rate(logger.info, [line], lines))
+        print("  {:>24}: {:>10,.0f} lines/sec".format(
+            formatter_class.__name__, rates[-1]))
+    print("  speedup: {:.2f}x".format(rates[1] / rates[0]))
+    record(results, "handlers", {"handlers": handlers},
+           before_lines_per_sec=rates[0], lines_per_sec=rates[1])
+
+
+def bench_pool(results: List[Dict], acquires: int,
+               handshake_ms: float) -> None:
+    """
+    Compares opening a connection per job with checking one out of a
+    ConnectionPool, using SQLite behind a simulated handshake.
+    """
+    def connect() -> sqlite3.Connection:
+        """ Open an in-memory SQLite connection after a fake handshake """
+        time.sleep(handshake_ms / 1000)
+        return sqlite3.connect(":memory:", check_same_thread=False)
+
+    def job(db) -> None:
+        """ Run a trivial query, like a job using get_db() would """
+        cursor = db.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+        db.close()
+
+    start = time.perf_counter()
+    for _ in range(acquires):
+        job(connect())
+    direct = (time.perf_counter() - start) / acquires
+
+    pool = ConnectionPool(connect, size=4)
+    start = time.perf_counter()
+    for _ in range(acquires):
+        job(pool.acquire())
+    pooled = (time.perf_counter() - start) / acquires
+    pool.close()
+
+    print("\nconnection acquire + query, {} jobs, {} ms handshake:".format(
+        acquires, handshake_ms))
+    print("  direct: {:9.1f} us/job".format(direct * 1e6))
+    print("  pooled: {:9.1f} us/job ({:.0f}x)".format(
+        pooled * 1e6, direct / pooled))
+    record(results, "pool", {"handshake_ms": handshake_ms},
+           direct_us=direct * 1e6, pooled_us=pooled * 1e6)
+
+
+def bench_hashing(results: List[Dict], passwords: int,
+                  budget_ms: float) -> None:
+    """
+    Measures hash_many throughput as the number of threads grows.
+    """
+    import encrypt_password
+
+    rounds = encrypt_password.calibrate(budget_ms, os.devnull)
+    batch = ["password{}".format(i) for i in range(passwords)]
+    print("\nhash_many, {} passwords, bcrypt cost {}:".format(
+        passwords, rounds))
+    workers = 1
+    baseline = None
+    while True:
+        start = time.perf_counter()
+        hashed = encrypt_password.hash_many(batch, workers)
+        per_sec = passwords / (time.perf_counter() - start)
+        baseline = baseline or per_sec
+        print("  {:>3} threads: {:>9,.1f} hashes/sec ({:.2f}x)".format(
+            workers, per_sec, per_sec / baseline))
+        record(results, "hashing", {"threads": workers, "rounds": rounds},
+               hashes_per_sec=per_sec)
+        if workers >= (os.cpu_count() or 1):
+            break
+        workers = min(workers * 2, os.cpu_count() or 1)
+    assert all(encrypt_password.verify_many(zip(hashed, batch)))
+
+
+def compare(results: List[Dict], path: str) -> None:
+    """
+    Prints the ratio of every metric to the same one in a previous
+    results file.
+    """
+    with open(path) as f:
+        previous = {
+            (r["benchmark"], json.dumps(r["params"], sort_keys=True)): r
+            for r in json.load(f)["results"]
+        }
+    print("\ncompared to {}:".format(path))
+    for result in results:
+        key = (result["benchmark"],
+               json.dumps(result["params"], sort_keys=True))
+        old = previous.get(key)
+        if old is None:
+            continue
+        for metric, value in result["metrics"].items():
+            before = old["metrics"].get(metric)
+            if before:
+                print("  {:<10} {:<45} {:<22} {:>6.2f}x".format(
+                    result["benchmark"], key[1], metric, value / before))
+
+
+BENCHMARKS = ("synthetic", "formatter", "export", "legacy", "engines",
+              "get_logger", "handlers", "hashing", "pool")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--lines", type=int, default=20000,
+                        help="log lines redacted per measurement")
+    parser.add_argument("--rows", type=int, default=100000,
+                        help="rows of the exported users table")
+    parser.add_argument("--passwords", type=int, default=64,
+                        help="passwords hashed per hashing measurement")
+    parser.add_argument("--hash-budget-ms", type=float, default=20.0,
+                        help="latency budget of the benchmarked bcrypt cost")
+    parser.add_argument("--acquires", type=int, default=200,
+                        help="connections acquired per pool measurement")
+    parser.add_argument("--handshake-ms", type=float, default=2.0,
+                        help="simulated connection handshake")
+    parser.add_argument("--only", default=",".join(BENCHMARKS),
+                        help="comma separated benchmarks to run")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="previous JSON results")
+    args = parser.parse_args()
+
+    results: List[Dict] = []
+    selected = args.only.split(",")
+    runs = {
+        "synthetic": lambda: bench_synthetic(results, args.lines // 10),
+        "formatter": lambda: bench_formatter(results, args.lines),
+        "export": lambda: bench_export(results, args.rows),
+        "legacy": lambda: bench_legacy(results, args.lines),
+        "engines": lambda: bench_engines(results, args.lines),
+        "get_logger": lambda: bench_get_logger(results, args.lines),
+        "handlers": lambda: bench_handlers(results, args.lines),
+        "hashing": lambda: bench_hashing(results, args.passwords,
+                                         args.hash_budget_ms),
+        "pool": lambda: bench_pool(results, args.acquires,
+                                   args.handshake_ms),
+    }
+    for name in BENCHMARKS:
+        if name in selected:
+            runs[name]()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": platform.python_version(),
+                       "machine": platform.machine(),
+                       "args": vars(args),
+                       "results": results}, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
@@ -2,10 +2,163 @@
 """
 This module provides functions to hash passwords
 and validate them using bcrypt.
+
+The bcrypt cost (log2 rounds) is calibrated on the host: the highest
+cost whose hashing time stays under BCRYPT_LATENCY_BUDGET_MS (default
+250 ms), but never below the security floor BCRYPT_ROUNDS_FLOOR
+(default 12, bcrypt's own default; at least 10), which wins over the
+budget on slow hosts. The result is cached in BCRYPT_CALIBRATION_FILE
+(default ".bcrypt_calibration.json") so later processes skip the
+measurement; a cached cost outside [floor, 31] is ignored.
+
+bcrypt releases the GIL, so hash_many and verify_many (and their
+asyncio variants) spread batches of passwords over a thread pool of
+BCRYPT_POOL_SIZE threads (default: one per core).
 """
 
+import asyncio
+import json
+import os
+import platform
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
 import bcrypt
 
+BCRYPT_MIN_ROUNDS = 4
+BCRYPT_MAX_ROUNDS = 31
+BCRYPT_PROBE_ROUNDS = 8
+BCRYPT_FLOOR_ROUNDS = 12
+BCRYPT_LOWEST_FLOOR = 10
+LATENCY_BUDGET_MS = 250.0
+CALIBRATION_FILE = ".bcrypt_calibration.json"
+
+_rounds = None
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def measure_rounds(rounds: int, samples: int = 3) -> float:
+    """
+    Measures how long bcrypt takes to hash a password at a given cost.
+
+    Args:
+        rounds (int): The bcrypt cost (log2 rounds).
+        samples (int): The number of measurements to take.
+
+    Returns:
+        float: The fastest measurement, in milliseconds.
+    """
+    salt = bcrypt.gensalt(rounds)
+    best = float("inf")
+    for _ in range(samples):
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration password", salt)
+        best = min(best, (time.perf_counter() - start) * 1000)
+    return best
+
+
+def rounds_floor() -> int:
+    """
+    Returns the lowest bcrypt cost calibrate may pick.
+
+    Returns:
+        int: BCRYPT_ROUNDS_FLOOR, default BCRYPT_FLOOR_ROUNDS.
+
+    Raises:
+        ValueError: If the floor is below BCRYPT_LOWEST_FLOOR or above
+            BCRYPT_MAX_ROUNDS.
+    """
+    floor = int(os.getenv("BCRYPT_ROUNDS_FLOOR", BCRYPT_FLOOR_ROUNDS))
+    if not BCRYPT_LOWEST_FLOOR <= floor <= BCRYPT_MAX_ROUNDS:
+        raise ValueError("BCRYPT_ROUNDS_FLOOR must be between {} and {}"
+                         .format(BCRYPT_LOWEST_FLOOR, BCRYPT_MAX_ROUNDS))
+    return floor
+
+
+def calibrate(budget_ms: float = None, cache_path: str = None) -> int:
+    """
+    Picks the highest bcrypt cost hashing within the latency budget,
+    and at least rounds_floor().
+
+    The time of a cheap probe is doubled per extra round to find the
+    candidate, which is then measured once to confirm it. A calibration
+    cached for the same host and budget is reused if its cost lies
+    between the floor and BCRYPT_MAX_ROUNDS.
+
+    Args:
+        budget_ms (float): The latency budget of one hash, defaulting to
+            BCRYPT_LATENCY_BUDGET_MS.
+        cache_path (str): The calibration cache, defaulting to
+            BCRYPT_CALIBRATION_FILE.
+
+    Returns:
+        int: The chosen cost, also returned by get_rounds from now on.
+    """
+    global _rounds
+
+    if budget_ms is None:
+        budget_ms = float(os.getenv("BCRYPT_LATENCY_BUDGET_MS",
+                                    LATENCY_BUDGET_MS))
+    if cache_path is None:
+        cache_path = os.getenv("BCRYPT_CALIBRATION_FILE", CALIBRATION_FILE)
+    host = platform.node()
+    floor = rounds_floor()
+
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached.get("host") == host and \
+                cached.get("budget_ms") == budget_ms:
+            rounds = int(cached["rounds"])
+            if floor <= rounds <= BCRYPT_MAX_ROUNDS:
+                _rounds = rounds
+                return _rounds
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        pass
+
+    rounds = BCRYPT_PROBE_ROUNDS
+    elapsed = measure_rounds(rounds)
+    while rounds < BCRYPT_MAX_ROUNDS and elapsed * 2 <= budget_ms:
+        rounds += 1
+        elapsed *= 2
+    while rounds > BCRYPT_MIN_ROUNDS and elapsed > budget_ms:
+        rounds -= 1
+        elapsed /= 2
+    if rounds >= floor:
+        elapsed = measure_rounds(rounds, 1)
+        if elapsed > budget_ms and rounds > floor:
+            rounds -= 1
+            elapsed /= 2
+    else:
+        # The budget is too small for the floor: hash slower instead
+        elapsed *= 2 ** (floor - rounds)
+        rounds = floor
+
+    try:
+        with open(cache_path, "w") as f:
+            json.dump({"host": host, "budget_ms": budget_ms,
+                       "rounds": rounds, "measured_ms": elapsed}, f)
+    except OSError:
+        pass
+    _rounds = rounds
+    return _rounds
+
+
+def get_rounds() -> int:
+    """
+    Returns the bcrypt cost used by hash_password, calibrating it on
+    first use.
+
+    Returns:
+        int: The bcrypt cost (log2 rounds).
+    """
+    if _rounds is None:
+        return calibrate()
+    return _rounds
+
 
 def hash_password(password: str) -> bytes:
     """
@@ -17,7 +170,7 @@ def hash_password(password: str) -> bytes:
     Returns:
         bytes: The salted, hashed password.
     """
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(get_rounds())
     hashed = bcrypt.hashpw(password.encode(), salt)
     return hashed
 
@@ -35,3 +188,107 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
         password, False otherwise.
     """
     return bcrypt.checkpw(password.encode(), hashed_password)
+
+
+def _check(pair: Tuple[bytes, str]) -> bool:
+    """ Validate a (hashed password, password) pair """
+    return is_valid(*pair)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the shared hashing thread pool, creating it on first use.
+
+    Returns:
+        ThreadPoolExecutor: A pool of BCRYPT_POOL_SIZE threads.
+    """
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    int(os.getenv("BCRYPT_POOL_SIZE", os.cpu_count() or 1)),
+                    thread_name_prefix="bcrypt"
+                )
+    return _executor
+
+
+def hash_many(passwords: Iterable[str],
+              workers: Optional[int] = None) -> List[bytes]:
+    """
+    Hashes passwords in parallel, e.g. for a bulk user import.
+
+    Args:
+        passwords (Iterable[str]): The passwords to hash.
+        workers (Optional[int]): The number of threads to use, instead
+            of the shared pool.
+
+    Returns:
+        List[bytes]: The hashed passwords, in input order.
+    """
+    get_rounds()
+    if workers is None:
+        return list(_get_executor().map(hash_password, passwords))
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(hash_password, passwords))
+
+
+def verify_many(pairs: Iterable[Tuple[bytes, str]],
+                workers: Optional[int] = None) -> List[bool]:
+    """
+    Validates passwords in parallel, e.g. for a password migration.
+
+    Args:
+        pairs (Iterable[Tuple[bytes, str]]): The (hashed password,
+            password) pairs to validate.
+        workers (Optional[int]): The number of threads to use, instead
+            of the shared pool.
+
+    Returns:
+        List[bool]: Whether each password matches, in input order.
+    """
+    if workers is None:
+        return list(_get_executor().map(_check, pairs))
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(_check, pairs))
+
+
+async def hash_many_async(passwords: Iterable[str]) -> List[bytes]:
+    """
+    Awaitable hash_many, running on the shared pool so the event loop
+    keeps serving other tasks.
+
+    Args:
+        passwords (Iterable[str]): The passwords to hash.
+
+    Returns:
+        List[bytes]: The hashed passwords, in input order.
+    """
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    await loop.run_in_executor(executor, get_rounds)
+    return list(await asyncio.gather(*(
+        loop.run_in_executor(executor, hash_password, password)
+        for password in passwords
+    )))
+
+
+async def verify_many_async(
+        pairs: Iterable[Tuple[bytes, str]]) -> List[bool]:
+    """
+    Awaitable verify_many, running on the shared pool so the event loop
+    keeps serving other tasks.
+
+    Args:
+        pairs (Iterable[Tuple[bytes, str]]): The (hashed password,
+            password) pairs to validate.
+
+    Returns:
+        List[bool]: Whether each password matches, in input order.
+    """
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    return list(await asyncio.gather(*(
+        loop.run_in_executor(executor, _check, pair) for pair in pairs
+    )))
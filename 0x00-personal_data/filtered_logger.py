@@ -1,26 +1,182 @@
 #!/usr/bin/env python3
 """
 This module provides functions to obfuscate sensitive data in log messages,
-a logging formatter to use it, a logger setup to handle log messages,
-and a function to connect to a MySQL database.
+a logging formatter to use it, a logger setup to handle log messages
+(optionally redacted and written on a background thread),
+and a function to connect to a MySQL database (optionally through a
+connection pool).
 """
 
 import re
+import atexit
+import copy
 import logging
+import logging.handlers
 import os
-from typing import List, Tuple
+import queue
+import resource
+import sys
+import threading
+import time
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, List, Match, Sequence, Set, Tuple
 import mysql.connector
 
 PII_FIELDS: Tuple[str, ...] = ("name", "email", "phone", "ssn", "password")
+PATTERN_CACHE_SIZE = 128
+SCAN_ENGINE_MIN_FIELDS = 200
+LOG_QUEUE_SIZE = 10000
+EXPORT_BATCH_SIZE = 1000
+OVERFLOW_POLICIES: Tuple[str, ...] = ("block", "drop-oldest", "drop-new")
 
+_handler = None
+_listener = None
+_logger_config = None
+_logger_lock = threading.Lock()
+_pools: Dict[str, 'ConnectionPool'] = {}
+_pools_lock = threading.Lock()
 
-def filter_datum(fields: List[str], redaction: str,
+
+def _value_pattern(separator: str, lines: bool) -> str:
+    """
+    Returns the regular expression of a field value.
+
+    A value runs up to the separator; in a block of lines it also stops
+    at the end of its line, "\n" or "\r\n", while a lone "\r" is part
+    of it as it is for a single line.
+
+    Args:
+        separator (str): The character(s) terminating a field value.
+        lines (bool): Whether the messages are blocks of lines.
+
+    Returns:
+        str: The regular expression matching a value.
+    """
+    if not lines:
+        return '[^{}]*'.format(separator)
+    return '[^{0}\r\n]*(?:\r(?!\n)[^{0}\r\n]*)*'.format(separator)
+
+
+def _regex_redactor(fields: Tuple[str, ...], redaction: str,
+                    separator: str,
+                    lines: bool = False) -> Callable[[str], str]:
+    """
+    Builds a redaction function around a single regex alternation.
+
+    The field name is captured in a group, so a match is replaced by
+    concatenating that group with a precomputed tail instead of
+    splitting the whole match on '='.
+
+    Args:
+        fields (Tuple[str, ...]): The fields to obfuscate.
+        redaction (str): The string replacing each field value.
+        separator (str): The character(s) terminating a field value.
+        lines (bool): Whether values also end with their line.
+
+    Returns:
+        Callable[[str], str]: A function redacting a message.
+    """
+    pattern = re.compile('({})={}'.format(
+        '|'.join(fields), _value_pattern(separator, lines)))
+    tail = '=' + redaction
+
+    def replace(match: Match) -> str:
+        """ Keep the field name and redact its value """
+        return match[1] + tail
+
+    return partial(pattern.sub, replace)
+
+
+def _scan_redactor(fields: Tuple[str, ...], redaction: str,
+                   separator: str,
+                   lines: bool = False) -> Callable[[str], str]:
+    """
+    Builds a redaction function that walks the '=' of a message and
+    looks the text before each one up in per-length sets of fields.
+
+    It produces exactly what _regex_redactor produces: a field matches
+    wherever it is immediately followed by '=', even as the suffix of a
+    longer key, and the longest such field wins. Its cost grows with
+    the number of distinct field lengths instead of the number of
+    fields, which pays off for long field lists. Fields must be
+    literals without '='.
+
+    Args:
+        fields (Tuple[str, ...]): The fields to obfuscate.
+        redaction (str): The string replacing each field value.
+        separator (str): The character(s) terminating a field value.
+        lines (bool): Whether values also end with their line.
+
+    Returns:
+        Callable[[str], str]: A function redacting a message.
+    """
+    by_length: Dict[int, Set[str]] = {}
+    for field in fields:
+        by_length.setdefault(len(field), set()).add(field)
+    lengths = sorted(by_length.items(), reverse=True)
+    value = re.compile(_value_pattern(separator, lines))
+
+    def redact(message: str) -> str:
+        """ Redact every field of one message """
+        parts = []
+        emitted = cursor = 0
+        equal = message.find('=')
+        while equal >= 0:
+            for length, names in lengths:
+                if equal - length >= cursor \
+                        and message[equal - length:equal] in names:
+                    parts.append(message[emitted:equal + 1])
+                    parts.append(redaction)
+                    emitted = cursor = value.match(message, equal + 1).end()
+                    break
+            else:
+                cursor = equal + 1
+            equal = message.find('=', cursor)
+        if not parts:
+            return message
+        parts.append(message[emitted:])
+        return ''.join(parts)
+
+    return redact
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _redactor(fields: Tuple[str, ...], redaction: str,
+              separator: str, lines: bool = False) -> Callable[[str], str]:
+    """
+    Returns the redaction function used by filter_datum (or filter_lines
+    with lines), built once per (fields, redaction, separator, lines).
+
+    Long lists of literal fields use the scanning engine, anything else
+    (short lists, or fields written as regular expressions) the regex
+    engine.
+
+    Args:
+        fields (Tuple[str, ...]): The fields to obfuscate.
+        redaction (str): The string replacing each field value.
+        separator (str): The character(s) terminating a field value.
+        lines (bool): Whether values also end with their line.
+
+    Returns:
+        Callable[[str], str]: A function redacting a message.
+    """
+    if len(fields) >= SCAN_ENGINE_MIN_FIELDS and all(
+        re.escape(field) == field and '=' not in field for field in fields
+    ):
+        return _scan_redactor(fields, redaction, separator, lines)
+    return _regex_redactor(fields, redaction, separator, lines)
+
+
+def filter_datum(fields: Sequence[str], redaction: str,
                  message: str, separator: str) -> str:
     """
     Obfuscates the values of specified fields in a log message.
 
+    A tuple of fields is used as the cache key as is; other sequences
+    are copied to one on every call.
+
     Args:
-        fields (List[str]): A list of strings representing all
+        fields (Sequence[str]): A sequence of strings representing all
             fields to obfuscate.
         redaction (str): A string representing by what the field
             will be obfuscated.
@@ -31,14 +187,34 @@ def filter_datum(fields: List[str], redaction: str,
     Returns:
         str: The log message with specified field values obfuscated.
     """
-    pattern = '|'.join([
-        f'{field}=[^{separator}]*' for field in fields
-    ])
-    return re.sub(
-        pattern,
-        lambda m: m.group().split('=')[0] + '=' + redaction,
-        message
-    )
+    if not fields:
+        return message
+    if not isinstance(fields, tuple):
+        fields = tuple(fields)
+    return _redactor(fields, redaction, separator)(message)
+
+
+def filter_lines(fields: Sequence[str], redaction: str,
+                 text: str, separator: str) -> str:
+    """
+    Obfuscates the values of specified fields in a block of log lines.
+
+    Values end at the separator or at the end of their line, which is
+    kept, so each line is redacted exactly like filter_datum redacts it
+    without its "\n" or "\r\n".
+
+    Args:
+        fields (Sequence[str]): The fields to obfuscate.
+        redaction (str): The string replacing each field value.
+        text (str): The lines, with their line ends.
+        separator (str): The character(s) terminating a field value.
+
+    Returns:
+        str: The lines with specified field values obfuscated.
+    """
+    if not fields:
+        return text
+    return _redactor(tuple(fields), redaction, separator, True)(text)
 
 
 class RedactingFormatter(logging.Formatter):
@@ -58,46 +234,429 @@ class RedactingFormatter(logging.Formatter):
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
 
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        """
+        The fields to redact in the log message.
+
+        They are kept as a tuple, so they can only change by assigning
+        new fields, which rebuilds the redaction function.
+
+        Returns:
+            Tuple[str, ...]: The fields to redact.
+        """
+        return self._fields
+
+    @fields.setter
+    def fields(self, fields: Sequence[str]) -> None:
+        """
+        Set the fields to redact and build their redaction function.
+
+        Args:
+            fields (Sequence[str]): The fields to redact.
+        """
+        self._fields = tuple(fields)
+        self._redactor = None
+        if self._fields:
+            self._redactor = _redactor(
+                self._fields, self.REDACTION, self.SEPARATOR
+            )
+
+    def redact(self, record: logging.LogRecord) -> str:
+        """
+        Return the final message of a record with the fields redacted.
+
+        The redaction function is built when the fields are set, shared by
+        the formatters with the same (fields, redaction, separator). The
+        result is cached on the record under that function, so handlers
+        sharing a record redact it only once, and no key proportional
+        to the number of fields is built or hashed per record.
+        log_redacted seeds that cache for the lines it logs.
+
+        Args:
+            record (logging.LogRecord): The log record to redact.
+
+        Returns:
+            str: The redacted message.
+        """
+        cache = record.__dict__.setdefault("redacted_messages", {})
+        message = cache.get(self._redactor)
+        if message is None:
+            message = record.getMessage()
+            if self._redactor is not None:
+                message = self._redactor(message)
+            cache[self._redactor] = message
+        return message
+
     def format(self, record: logging.LogRecord) -> str:
         """
         Format the specified log record.
 
+        The record itself is left untouched: its message and arguments
+        are only swapped for the redacted message while formatting.
+        Nothing is redacted for records no handler formats.
+
         Args:
             record (logging.LogRecord): The log record to format.
 
         Returns:
             str: The formatted log record with specified fields redacted.
         """
-        record.msg = filter_datum(
-            self.fields, self.REDACTION, record.msg, self.SEPARATOR
-        )
-        return super().format(record)
+        msg, args = record.msg, record.args
+        record.msg, record.args = self.redact(record), None
+        try:
+            return super().format(record)
+        finally:
+            record.msg, record.args = msg, args
 
 
-def get_logger() -> logging.Logger:
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """ Queue handler feeding a bounded queue with unredacted records
+    """
+
+    def __init__(self, log_queue: queue.Queue, overflow: str = "block"):
+        """
+        Initialize the handler with its queue and overflow policy.
+
+        Args:
+            log_queue (queue.Queue): The (bounded) queue to feed.
+            overflow (str): What to do when the queue is full: "block"
+                the caller, "drop-oldest" queued record or "drop-new"
+                record.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: {}".format(overflow))
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Merge the arguments into the message of a copy of the record.
+
+        Unlike QueueHandler.prepare, the record is not formatted here:
+        redaction is left to the handlers of the listener thread.
+
+        Args:
+            record (logging.LogRecord): The record being logged.
+
+        Returns:
+            logging.LogRecord: The record to enqueue.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """
+        Put a record on the queue, applying the overflow policy.
+
+        Args:
+            record (logging.LogRecord): The prepared record.
+        """
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                if self.overflow == "drop-new":
+                    self.dropped += 1
+                    return
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+
+
+class RedactingQueueListener(logging.handlers.QueueListener):
+    """ Queue listener redacting and writing records on its own thread
+    """
+
+    def enqueue_sentinel(self) -> None:
+        """
+        Wait for room on a full queue instead of failing, so that every
+        record queued before the shutdown is still written.
+        """
+        self.queue.put(self._sentinel)
+
+
+def shutdown_logger() -> None:
+    """
+    Detach the handler installed by get_logger on the "user_data" logger
+    and, in queued mode, wait for the listener thread to redact and
+    write every queued record.
+
+    Registered with atexit, it can also be called directly, e.g. by a
+    worker shutting down. The next get_logger call configures the
+    logger again.
+    """
+    global _handler, _listener, _logger_config
+
+    if _handler is not None:
+        logging.getLogger("user_data").removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    _logger_config = None
+
+
+atexit.register(shutdown_logger)
+
+
+def get_logger(queued: bool = None, queue_size: int = None,
+               overflow: str = None,
+               reconfigure: bool = False) -> logging.Logger:
     """
     Creates a logger named "user_data" to log messages with a
     specified formatting and redaction.
 
+    The logger is configured once, by the first call: later calls
+    return it as is, so calling get_logger per request or per batch
+    never stacks handlers. Arguments left out keep the current
+    configuration (or the defaults: synchronous, LOG_QUEUE_SIZE,
+    "block"), so a plain get_logger() never undoes a queued setup made
+    by the application. Changing the configuration of a configured
+    logger takes reconfigure=True; without it, a call asking for
+    another configuration raises ValueError.
+
+    In queued mode the logger only enqueues records; redaction and
+    writes to the stream happen on a background listener thread, which
+    is flushed by shutdown_logger at exit.
+
+    Args:
+        queued (bool): Whether to redact and write on a background
+            thread.
+        queue_size (int): The maximum number of records waiting in the
+            queue (0 for unbounded).
+        overflow (str): The policy applied when the queue is full:
+            "block", "drop-oldest" or "drop-new".
+        reconfigure (bool): Whether to replace the configuration of an
+            already configured logger.
+
     Returns:
         logging.Logger: The configured logger object.
+
+    Raises:
+        ValueError: If another configuration is asked for without
+            reconfigure.
     """
+    global _handler, _listener, _logger_config
+
     logger = logging.getLogger("user_data")
-    logger.setLevel(logging.INFO)
-    logger.propagate = False
+    requested = (queued, queue_size, overflow)
+    current = _logger_config
+    if current is not None and all(
+        value is None or value == configured
+        for value, configured in zip(requested, current)
+    ):
+        return logger
+
+    with _logger_lock:
+        config = tuple(
+            default if value is None else value for value, default in zip(
+                requested,
+                _logger_config or (False, LOG_QUEUE_SIZE, "block")
+            )
+        )
+        if config == _logger_config:
+            return logger
+        if _logger_config is not None and not reconfigure:
+            raise ValueError(
+                "The user_data logger is already configured as {}; pass "
+                "reconfigure=True to change it to {}".format(
+                    _logger_config, config)
+            )
+        shutdown_logger()
+        queued, queue_size, overflow = config
+
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        stream_handler = logging.StreamHandler()
+        formatter = RedactingFormatter(list(PII_FIELDS))
+        stream_handler.setFormatter(formatter)
 
-    stream_handler = logging.StreamHandler()
-    formatter = RedactingFormatter(list(PII_FIELDS))
-    stream_handler.setFormatter(formatter)
+        if queued:
+            log_queue = queue.Queue(queue_size)
+            _handler = BoundedQueueHandler(log_queue, overflow)
+            _listener = RedactingQueueListener(
+                log_queue, stream_handler, respect_handler_level=True
+            )
+            _listener.start()
+        else:
+            _handler = stream_handler
 
-    logger.addHandler(stream_handler)
+        logger.addHandler(_handler)
+        _logger_config = config
 
     return logger
 
 
-def get_db() -> mysql.connector.connection.MySQLConnection:
+class PooledConnection:
+    """ Connection checked out of a ConnectionPool
+
+    It behaves like the underlying connection, except that close()
+    gives the connection back to its pool instead of closing it.
     """
-    Connects to the MySQL database using environment variables for credentials.
+
+    def __init__(self, pool: 'ConnectionPool', connection: Any,
+                 created_at: float):
+        """
+        Wrap a connection checked out of pool.
+
+        Args:
+            pool (ConnectionPool): The pool owning the connection.
+            connection (Any): The DB-API connection.
+            created_at (float): When the connection was opened
+                (time.monotonic()).
+        """
+        self._pool = pool
+        self._connection = connection
+        self._created_at = created_at
+
+    def __getattr__(self, name: str) -> Any:
+        """ Delegate everything else to the underlying connection """
+        if self._connection is None:
+            raise AttributeError("Connection returned to its pool")
+        return getattr(self._connection, name)
+
+    def __enter__(self) -> 'PooledConnection':
+        """ Use the connection as a context manager """
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """ Give the connection back when leaving the context """
+        self.close()
+
+    def close(self) -> None:
+        """ Give the connection back to the pool """
+        if self._connection is not None:
+            self._pool.release(self._connection, self._created_at)
+            self._connection = None
+
+
+class ConnectionPool:
+    """ Thread-safe pool of reusable database connections
+
+    Connections are opened lazily up to size, checked for health when
+    checked out, and closed instead of reused once older than recycle
+    seconds (0 disables recycling).
+    """
+
+    def __init__(self, connect: Callable[[], Any], size: int,
+                 recycle: float = 0, name: str = None):
+        """
+        Initialize an empty pool.
+
+        Args:
+            connect (Callable[[], Any]): Opens a new connection.
+            size (int): The maximum number of open connections.
+            recycle (float): The maximum age of a connection in seconds.
+            name (str): The name of the pool.
+        """
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.name = name
+        self.size = size
+        self.recycle = recycle
+        self._connect = connect
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @staticmethod
+    def is_alive(connection: Any) -> bool:
+        """
+        Health check run on every checkout: mysql.connector connections
+        are pinged with is_connected(), other DB-API connections run a
+        trivial query.
+
+        Args:
+            connection (Any): The connection to check.
+
+        Returns:
+            bool: True if the connection can be used.
+        """
+        try:
+            if hasattr(connection, "is_connected"):
+                return connection.is_connected()
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _discard(connection: Any) -> None:
+        """ Close a connection leaving the pool, ignoring errors """
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def acquire(self) -> PooledConnection:
+        """
+        Check a connection out of the pool, waiting for one to be
+        released when size connections are already in use.
+
+        Returns:
+            PooledConnection: The connection, to close() once done.
+        """
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    connection, created_at = self._idle.get_nowait()
+                except queue.Empty:
+                    return PooledConnection(
+                        self, self._connect(), time.monotonic()
+                    )
+                expired = self.recycle and \
+                    time.monotonic() - created_at > self.recycle
+                if not expired and self.is_alive(connection):
+                    return PooledConnection(self, connection, created_at)
+                self._discard(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection: Any, created_at: float) -> None:
+        """
+        Take back a connection, rolling back any open transaction.
+
+        Args:
+            connection (Any): The connection checked out of the pool.
+            created_at (float): When the connection was opened.
+        """
+        try:
+            connection.rollback()
+            self._idle.put((connection, created_at))
+        except Exception:
+            self._discard(connection)
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        """ Close every idle connection """
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(connection)
+
+
+def _connect() -> mysql.connector.connection.MySQLConnection:
+    """
+    Opens a new connection to the MySQL database using the
+    PERSONAL_DATA_DB_* environment variables for credentials.
 
     Returns:
         mysql.connector.connection.MySQLConnection:
@@ -119,12 +678,172 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     return db
 
 
+def get_db() -> mysql.connector.connection.MySQLConnection:
+    """
+    Connects to the MySQL database using environment variables for credentials.
+
+    When PERSONAL_DATA_DB_POOL_SIZE is set, connections come from a
+    ConnectionPool named PERSONAL_DATA_DB_POOL_NAME (default
+    "personal_data") whose connections are recycled after
+    PERSONAL_DATA_DB_POOL_RECYCLE seconds (default 0: never). Closing
+    such a connection gives it back to the pool.
+
+    Returns:
+        mysql.connector.connection.MySQLConnection:
+        The database connector object.
+    """
+    pool_size = os.getenv("PERSONAL_DATA_DB_POOL_SIZE")
+    if not pool_size:
+        return _connect()
+
+    name = os.getenv("PERSONAL_DATA_DB_POOL_NAME", "personal_data")
+    pool = _pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(name)
+            if pool is None:
+                pool = ConnectionPool(
+                    _connect, int(pool_size),
+                    float(os.getenv("PERSONAL_DATA_DB_POOL_RECYCLE", 0)),
+                    name
+                )
+                _pools[name] = pool
+    return pool.acquire()
+
+
+def row_template(description: Sequence[Tuple]) -> str:
+    """
+    Builds the str.format template of an exported row, e.g.
+    "name={}; email={}; " for the columns (name, email).
+
+    Args:
+        description (Sequence[Tuple]): The description of a cursor.
+
+    Returns:
+        str: The template to format each row with.
+    """
+    return ''.join(
+        '{}={{}}; '.format(column[0].replace('{', '{{').replace('}', '}}'))
+        for column in description
+    )
+
+
+def redact_lines(fields: Sequence[str], lines: List[str]) -> List[str]:
+    """
+    Redacts a batch of log lines with a single filter_datum call.
+
+    The lines are joined with newlines, redacted as one block and split
+    back; a batch holding a line with a newline of its own is redacted
+    line by line so line boundaries stay intact.
+
+    Args:
+        fields (Sequence[str]): The fields to obfuscate.
+        lines (List[str]): The lines to redact.
+
+    Returns:
+        List[str]: The redacted lines, in the same order.
+    """
+    block = '\n'.join(lines)
+    if block.count('\n') == len(lines) - 1:
+        return filter_datum(
+            fields, RedactingFormatter.REDACTION, block,
+            RedactingFormatter.SEPARATOR
+        ).split('\n')
+    return [filter_datum(fields, RedactingFormatter.REDACTION, line,
+                         RedactingFormatter.SEPARATOR) for line in lines]
+
+
+def log_redacted(logger: logging.Logger, fields: Sequence[str],
+                 lines: List[str]) -> None:
+    """
+    Log lines redact_lines already redacted with some fields.
+
+    The redaction cache of each record is seeded with its line under
+    the redaction function of these fields, so the formatters redacting
+    the same fields use it as is. Formatters redacting other fields
+    still redact it with theirs.
+
+    Args:
+        logger (logging.Logger): The logger to log the lines to.
+        fields (Sequence[str]): The fields the lines were redacted with.
+        lines (List[str]): The redacted lines.
+    """
+    key = _redactor(tuple(fields), RedactingFormatter.REDACTION,
+                    RedactingFormatter.SEPARATOR)
+    for line in lines:
+        logger.info(line, extra={"redacted_messages": {key: line}})
+
+
+def export_users(batch_size: int = EXPORT_BATCH_SIZE) -> Tuple[int, float]:
+    """
+    Stream the users table to the "user_data" logger batch by batch.
+
+    The rows are fetched with fetchmany from the default, unbuffered
+    mysql.connector cursor, so the server streams the result instead of
+    the client holding the whole table. Each batch is formatted with a
+    template precomputed from the columns and redacted by redact_lines
+    before its lines are logged by log_redacted.
+
+    Args:
+        batch_size (int): The number of rows fetched per round trip.
+
+    Returns:
+        Tuple[int, float]: The number of exported rows and the elapsed
+        time in seconds.
+    """
+    start = time.perf_counter()
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT * FROM users;")
+
+    template = row_template(cursor.description)
+    logger = get_logger()
+    rows = 0
+
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        lines = redact_lines(
+            PII_FIELDS, [template.format(*row) for row in batch]
+        )
+        log_redacted(logger, PII_FIELDS, lines)
+        rows += len(batch)
+
+    cursor.close()
+    db.close()
+
+    return rows, time.perf_counter() - start
+
+
 def main() -> None:
     """
     Obtain a database connection using get_db and retrieve
     all rows in the users table.
     Display each row under a filtered format.
+
+    When PERSONAL_DATA_EXPORT_BATCH_SIZE is set, the table is streamed
+    in batches of that size by export_users, and the throughput and
+    peak memory of the export are reported on stderr.
+
+    When PERSONAL_DATA_EXPORT_TABLES is set, the listed tables are
+    exported in parallel by table_export instead.
     """
+    if os.getenv("PERSONAL_DATA_EXPORT_TABLES"):
+        import table_export
+        table_export.main()
+        return
+
+    batch_size = os.getenv("PERSONAL_DATA_EXPORT_BATCH_SIZE")
+    if batch_size:
+        rows, elapsed = export_users(int(batch_size))
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print("exported {} rows in {:.2f}s ({:.0f} rows/sec), "
+              "peak memory {} KiB".format(
+                  rows, elapsed, rows / elapsed if elapsed else 0, peak),
+              file=sys.stderr)
+        return
+
     db = get_db()
     cursor = db.cursor()
     cursor.execute("SELECT * FROM users;")
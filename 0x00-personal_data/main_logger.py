@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Main file: get_logger configures the "user_data" logger once
+"""
+import io
+
+filtered_logger = __import__('filtered_logger')
+get_logger = filtered_logger.get_logger
+
+logger = get_logger()
+for _ in range(10):
+    logger = get_logger()
+print(len(logger.handlers))
+
+stream = io.StringIO()
+logger.handlers[0].setStream(stream)
+logger.info("name=Bob;email=bob@dylan.com;ip=10.0.0.1;")
+print(len(stream.getvalue().splitlines()))
+print("bob@dylan.com" in stream.getvalue())
+
+logger = get_logger(queued=True, reconfigure=True)
+logger = get_logger()
+print(type(logger.handlers[0]).__name__)
+print(filtered_logger._listener is not None)
+
+try:
+    get_logger(queued=False)
+except ValueError:
+    print("ValueError")
+print(type(logger.handlers[0]).__name__)
+
+logger = get_logger(queued=False, reconfigure=True)
+print(type(logger.handlers[0]).__name__)
+print(filtered_logger._listener is None)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Command line tool redacting the PII of existing log files written in
+the "key=value;" format understood by filter_datum.
+
+    ./redact_logs.py app.log -o app.redacted.log
+    ./redact_logs.py --in-place app.log.gz
+    ./redact_logs.py -j 8 --fields name,email,ssn app.log -o out.log.gz
+
+The input is split on line boundaries into chunks which are redacted
+in a pool of processes and written back in their original order.
+Plain files are memory-mapped and each worker maps its own chunk;
+gzip files (".gz") are decompressed as a stream. The output is gzip
+compressed when its name ends with ".gz" (in place: like the input).
+"""
+
+import argparse
+import gzip
+import mmap
+import os
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import BinaryIO, Iterator, Sequence, Tuple, Union
+
+from filtered_logger import PII_FIELDS, RedactingFormatter, filter_lines
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+Chunk = Union[bytes, Tuple[str, int, int]]
+
+
+def redact_chunk(chunk: Chunk, fields: Sequence[str],
+                 redaction: str, separator: str) -> bytes:
+    """
+    Redacts a chunk of whole log lines.
+
+    filter_lines ends values at the end of their line ("\n" or "\r\n")
+    as well as at the separator, so the chunk is redacted exactly like
+    filter_datum redacts each of its lines.
+
+    Args:
+        chunk (Chunk): The bytes of the chunk, or the (path, start, end)
+            range of a plain file holding it.
+        fields (Sequence[str]): The fields to obfuscate.
+        redaction (str): The string replacing each field value.
+        separator (str): The character(s) terminating a field value.
+
+    Returns:
+        bytes: The redacted chunk.
+    """
+    if not isinstance(chunk, bytes):
+        path, start, end = chunk
+        with open(path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            chunk = mm[start:end]
+    text = chunk.decode('utf-8', 'surrogateescape')
+    text = filter_lines(fields, redaction, text, separator)
+    return text.encode('utf-8', 'surrogateescape')
+
+
+def file_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Chunk]:
+    """
+    Splits a plain file into ranges of about chunk_size bytes, each
+    ending on a line boundary.
+
+    Args:
+        path (str): The file to split.
+        chunk_size (int): The target size of a chunk.
+
+    Yields:
+        Chunk: The (path, start, end) range of each chunk.
+    """
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < len(mm):
+            end = mm.find(b'\n', start + chunk_size) + 1 or len(mm)
+            yield path, start, end
+            start = end
+
+
+def stream_chunks(stream: BinaryIO,
+                  chunk_size: int = CHUNK_SIZE) -> Iterator[Chunk]:
+    """
+    Splits a stream (e.g. a gzip file) into chunks of about chunk_size
+    bytes, each ending on a line boundary.
+
+    Args:
+        stream (BinaryIO): The stream to split.
+        chunk_size (int): The target size of a chunk.
+
+    Yields:
+        Chunk: The bytes of each chunk.
+    """
+    pending = b''
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+        data = pending + data
+        cut = data.rfind(b'\n') + 1
+        if cut == 0:
+            pending = data
+            continue
+        pending = data[cut:]
+        yield data[:cut]
+    if pending:
+        yield pending
+
+
+def redact_file(source: str, destination: str, fields: Sequence[str],
+                jobs: int = None, chunk_size: int = CHUNK_SIZE) -> None:
+    """
+    Redacts the log file source into destination.
+
+    At most two chunks per worker are in flight, which bounds memory
+    use whatever the size of the file.
+
+    Args:
+        source (str): The log file to redact (gzip if it ends in .gz).
+        destination (str): The file to write (gzip if it ends in .gz).
+        fields (Sequence[str]): The fields to obfuscate.
+        jobs (int): The number of worker processes (default: one per
+            core).
+        chunk_size (int): The target size of a chunk.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    redaction = RedactingFormatter.REDACTION
+    separator = RedactingFormatter.SEPARATOR
+    compressed = source.endswith('.gz')
+    reader = gzip.open(source, 'rb') if compressed else None
+    writer = (gzip.open if destination.endswith('.gz') else open)(
+        destination, 'wb'
+    )
+    chunks = (stream_chunks(reader, chunk_size) if compressed
+              else file_chunks(source, chunk_size))
+    pending: deque = deque()
+
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for chunk in chunks:
+                pending.append(pool.submit(
+                    redact_chunk, chunk, fields, redaction, separator
+                ))
+                if len(pending) >= 2 * jobs:
+                    writer.write(pending.popleft().result())
+            while pending:
+                future: Future = pending.popleft()
+                writer.write(future.result())
+    finally:
+        writer.close()
+        if reader is not None:
+            reader.close()
+
+
+def redact_in_place(path: str, fields: Sequence[str], jobs: int = None,
+                    chunk_size: int = CHUNK_SIZE) -> None:
+    """
+    Redacts a log file in place, through a temporary file of the same
+    directory renamed over it once complete.
+
+    Args:
+        path (str): The log file to redact (gzip if it ends in .gz).
+        fields (Sequence[str]): The fields to obfuscate.
+        jobs (int): The number of worker processes.
+        chunk_size (int): The target size of a chunk.
+    """
+    suffix = '.gz' if path.endswith('.gz') else ''
+    fd, temporary = tempfile.mkstemp(
+        suffix=suffix, dir=os.path.dirname(os.path.abspath(path))
+    )
+    os.close(fd)
+    try:
+        redact_file(path, temporary, fields, jobs, chunk_size)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def main(argv: Sequence[str] = None) -> int:
+    """
+    Parses the command line and redacts the requested file.
+    """
+    parser = argparse.ArgumentParser(
+        description="Redact PII fields of key=value; log files."
+    )
+    parser.add_argument("source", help="log file to redact (.gz allowed)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("-o", "--output",
+                        help="file to write (.gz to compress it)")
+    target.add_argument("-i", "--in-place", action="store_true",
+                        help="overwrite the source file")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--fields", default=",".join(PII_FIELDS),
+                        help="comma separated fields to redact "
+                             "(default: PII_FIELDS)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="bytes per chunk (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    fields = [field for field in args.fields.split(",") if field]
+    if args.in_place:
+        redact_in_place(args.source, fields, args.jobs, args.chunk_size)
+    else:
+        redact_file(args.source, args.output, fields, args.jobs,
+                    args.chunk_size)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+This module exports several PII tables in parallel to the "user_data"
+logger, redacted like the users table exported by filtered_logger.
+
+    PERSONAL_DATA_EXPORT_TABLES="users,contacts:contact_id,addresses" \
+        ./table_export.py
+
+Each table ("table" or "table:primary_key", the key defaulting to
+"id") is read by its own thread with keyset pagination: every query
+fetches the next batch of rows whose key is greater than the last key
+read, so no query keeps a long-running scan open. All readers feed a
+single writer which redacts each batch and logs its lines, prefixed
+with "table=<name>; ".
+
+After each batch it writes, the writer saves the last key of the table
+to a checkpoint file (PERSONAL_DATA_EXPORT_CHECKPOINT, default
+".export_checkpoint.json"). An interrupted export started again
+resumes after those keys; the file is removed once the export
+completes. Lines written between the last checkpoint and a crash are
+exported again.
+
+export_tables accepts any DB-API connection factory, e.g. SQLite:
+
+    export_tables(["users"], lambda: sqlite3.connect("users.db"),
+                  placeholder="?")
+"""
+
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from filtered_logger import (
+    EXPORT_BATCH_SIZE, PII_FIELDS, get_db, get_logger, log_redacted,
+    redact_lines, row_template
+)
+
+CHECKPOINT_FILE = ".export_checkpoint.json"
+IDENTIFIER = re.compile(r"^\w+$")
+
+_DONE = object()
+
+
+def parse_tables(spec: str) -> List[Tuple[str, str]]:
+    """
+    Parses a comma separated list of "table" or "table:primary_key".
+
+    Args:
+        spec (str): The tables to export, e.g. "users,contacts:cid".
+
+    Returns:
+        List[Tuple[str, str]]: The (table, primary key) pairs.
+
+    Raises:
+        ValueError: If a table or key is not a plain SQL identifier.
+    """
+    tables = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        table, _, key = item.partition(":")
+        key = key or "id"
+        for name in (table, key):
+            if not IDENTIFIER.match(name):
+                raise ValueError("Invalid SQL identifier: {}".format(name))
+        tables.append((table, key))
+    return tables
+
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    """
+    Reads the last exported key of each table.
+
+    Args:
+        path (str): The checkpoint file.
+
+    Returns:
+        Dict[str, Any]: The last key per table (empty without file).
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]) -> None:
+    """
+    Atomically replaces the checkpoint file.
+
+    Args:
+        path (str): The checkpoint file.
+        checkpoint (Dict[str, Any]): The last key per table.
+    """
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(checkpoint, f, default=str)
+    os.replace(temporary, path)
+
+
+def read_table(connect: Callable[[], Any], table: str, key: str,
+               after: Any, batch_size: int, placeholder: str,
+               batches: queue.Queue) -> None:
+    """
+    Reads a table in primary key order, one keyset page at a time, and
+    puts (table, template, rows, last key) batches on the queue. Ends
+    with (table, _DONE, None, None), or (table, exception, None, None)
+    when reading fails.
+
+    Args:
+        connect (Callable[[], Any]): Opens a DB-API connection.
+        table (str): The table to read.
+        key (str): Its primary key column.
+        after (Any): The last key already exported, or None.
+        batch_size (int): The number of rows per page.
+        placeholder (str): The parameter marker of the driver.
+        batches (queue.Queue): Where to put the batches.
+    """
+    first_page = "SELECT * FROM {0} ORDER BY {1} LIMIT {2}".format(
+        table, key, batch_size
+    )
+    next_page = "SELECT * FROM {0} WHERE {1} > {3} ORDER BY {1} " \
+        "LIMIT {2}".format(table, key, batch_size, placeholder)
+    try:
+        db = connect()
+        try:
+            cursor = db.cursor()
+            while True:
+                if after is None:
+                    cursor.execute(first_page)
+                else:
+                    cursor.execute(next_page, (after,))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                columns = [column[0] for column in cursor.description]
+                after = rows[-1][columns.index(key)]
+                template = "table={}; ".format(table) + \
+                    row_template(cursor.description)
+                batches.put((table, template, rows, after))
+                if len(rows) < batch_size:
+                    break
+            cursor.close()
+        finally:
+            db.close()
+    except Exception as e:
+        batches.put((table, e, None, None))
+        return
+    batches.put((table, _DONE, None, None))
+
+
+def export_tables(tables: Sequence[Tuple[str, str]],
+                  connect: Callable[[], Any] = get_db,
+                  batch_size: int = EXPORT_BATCH_SIZE,
+                  checkpoint_path: str = CHECKPOINT_FILE,
+                  placeholder: str = "%s") -> int:
+    """
+    Exports tables in parallel to the "user_data" logger, resuming
+    after the keys saved in the checkpoint file.
+
+    Args:
+        tables (Sequence[Tuple[str, str]]): The (table, primary key)
+            pairs to export.
+        connect (Callable[[], Any]): Opens a connection per reader.
+        batch_size (int): The number of rows per page.
+        checkpoint_path (str): The checkpoint file.
+        placeholder (str): The parameter marker of the driver ("%s"
+            for mysql.connector, "?" for sqlite3).
+
+    Returns:
+        int: The number of exported rows.
+
+    Raises:
+        Exception: The first error of a reader; the checkpoint is kept
+            so the export can be resumed.
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    batches: queue.Queue = queue.Queue(2 * len(tables) or 1)
+    readers = [
+        threading.Thread(
+            target=read_table, daemon=True,
+            args=(connect, table, key, checkpoint.get(table), batch_size,
+                  placeholder, batches)
+        )
+        for table, key in tables
+    ]
+    for reader in readers:
+        reader.start()
+
+    logger = get_logger()
+    remaining = len(readers)
+    rows = 0
+    while remaining:
+        table, template, batch, last = batches.get()
+        if template is _DONE:
+            remaining -= 1
+            continue
+        if isinstance(template, Exception):
+            raise template
+        lines = redact_lines(
+            PII_FIELDS, [template.format(*row) for row in batch]
+        )
+        log_redacted(logger, PII_FIELDS, lines)
+        rows += len(batch)
+        checkpoint[table] = last
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    for reader in readers:
+        reader.join()
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return rows
+
+
+def main() -> None:
+    """
+    Exports the tables listed in PERSONAL_DATA_EXPORT_TABLES (default
+    "users") and reports the throughput on stderr.
+    """
+    tables = parse_tables(os.getenv("PERSONAL_DATA_EXPORT_TABLES", "users"))
+    start = time.perf_counter()
+    rows = export_tables(
+        tables,
+        batch_size=int(os.getenv("PERSONAL_DATA_EXPORT_BATCH_SIZE",
+                                 EXPORT_BATCH_SIZE)),
+        checkpoint_path=os.getenv("PERSONAL_DATA_EXPORT_CHECKPOINT",
+                                  CHECKPOINT_FILE)
+    )
+    elapsed = time.perf_counter() - start
+    print("exported {} rows from {} tables in {:.2f}s ({:.0f} rows/sec)"
+          .format(rows, len(tables), elapsed,
+                  rows / elapsed if elapsed else 0), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
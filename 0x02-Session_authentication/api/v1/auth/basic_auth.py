@@ -4,14 +4,97 @@ BasicAuth module for handling basic authentication
 """
 
 import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
 from api.v1.auth.auth import Auth
 from models.user import User
 from typing import TypeVar
 
 
+class CredentialCache:
+    """
+    Bounded LRU cache of verified Authorization headers, each expiring
+    after ttl seconds.
+
+    Headers are keyed by their HMAC-SHA256 under a per-process random
+    key, so neither the header nor the password is ever stored. An
+    entry maps to the user id, email and password hash the header was
+    verified against; it is dropped as soon as that user is removed or
+    its email or password hash changes.
+    """
+
+    def __init__(self, size: int, ttl: float):
+        """ Create an empty cache of at most size entries """
+        self.size = size
+        self.ttl = ttl
+        self._secret = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, authorization_header: str) -> bytes:
+        """ Keyed digest of an Authorization header """
+        return hmac.new(self._secret, authorization_header.encode(),
+                        hashlib.sha256).digest()
+
+    def get(self, authorization_header: str) -> TypeVar('User'):
+        """ Return the user a header was verified for, or None """
+        if self.size <= 0:
+            return None
+        key = self._key(authorization_header)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user_id, email, password, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+
+        user = User.get(user_id)
+        if user is None or user.email != email or \
+                user.password != password:
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        return user
+
+    def put(self, authorization_header: str, user: TypeVar('User')):
+        """ Remember that a header was verified for a user """
+        if self.size <= 0:
+            return
+        key = self._key(authorization_header)
+        with self._lock:
+            self._entries[key] = (user.id, user.email, user.password,
+                                  time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """ Forget every verified header """
+        with self._lock:
+            self._entries.clear()
+
+
 class BasicAuth(Auth):
     """ BasicAuth class for handling basic authentication """
 
+    def __init__(self):
+        """
+        Create the cache of verified credentials, sized by
+        BASIC_AUTH_CACHE_SIZE (default 1024, 0 disables it) with a
+        lifetime of BASIC_AUTH_CACHE_TTL seconds (default 300)
+        """
+        self.credentials = CredentialCache(
+            int(os.getenv("BASIC_AUTH_CACHE_SIZE", 1024)),
+            float(os.getenv("BASIC_AUTH_CACHE_TTL", 300))
+        )
+
     def extract_base64_authorization_header(
         self, authorization_header: str
     ) -> str:
@@ -88,11 +171,19 @@ class BasicAuth(Auth):
     def current_user(self, request=None) -> TypeVar('User'):
         """
         Retrieves the User instance for a request using Basic Authentication
+
+        Headers verified recently are answered from the credential cache
+        without decoding them nor checking the password again.
         """
         if request is None:
             return None
 
         auth_header = self.authorization_header(request)
+        if isinstance(auth_header, str):
+            user = self.credentials.get(auth_header)
+            if user is not None:
+                return user
+
         base64_auth_header = (
             self.extract_base64_authorization_header(auth_header)
         )
@@ -103,4 +194,7 @@ class BasicAuth(Auth):
             self.extract_user_credentials(decoded_auth_header)
         )
 
-        return self.user_object_from_credentials(user_email, user_pwd)
+        user = self.user_object_from_credentials(user_email, user_pwd)
+        if user is not None:
+            self.credentials.put(auth_header, user)
+        return user
@@ -16,9 +16,9 @@ class SessionDBAuth(SessionExpAuth):
         if session_id is None:
             return None
 
+        UserSession.reload_if_changed()
         user_session = UserSession(user_id=user_id, session_id=session_id)
         user_session.save()
-        UserSession.save_to_file()
 
         return session_id
 
@@ -27,7 +27,7 @@ class SessionDBAuth(SessionExpAuth):
         if session_id is None:
             return None
 
-        UserSession.load_from_file()
+        UserSession.reload_if_changed()
         sessions = UserSession.search({'session_id': session_id})
 
         if not sessions:
@@ -50,7 +50,7 @@ class SessionDBAuth(SessionExpAuth):
         if session_id is None:
             return False
 
-        UserSession.load_from_file()
+        UserSession.reload_if_changed()
         sessions = UserSession.search({'session_id': session_id})
 
         if not sessions:
@@ -58,6 +58,5 @@ class SessionDBAuth(SessionExpAuth):
 
         user_session = sessions[0]
         user_session.remove()
-        UserSession.save_to_file()
 
         return True
@@ -9,10 +9,28 @@ from flask import abort, jsonify, request
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
-    """ This part requires a documentaion
+    """ List the users, all of them unless paginated by the optional
+    limit, offset and cursor parameters: pages are sorted by creation
+    date, and the X-Next-Cursor header of a full page is the cursor of
+    the next one
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    if not any(arg in request.args for arg in ('limit', 'offset', 'cursor')):
+        all_users = [user.to_json() for user in User.all()]
+        return jsonify(all_users)
+    query = User.query().order_by('created_at')
+    try:
+        if request.args.get('limit') is not None:
+            query = query.limit(int(request.args.get('limit')))
+        if request.args.get('offset') is not None:
+            query = query.offset(int(request.args.get('offset')))
+        query = query.after(request.args.get('cursor'))
+        users = list(query)
+    except ValueError:
+        abort(400)
+    response = jsonify([user.to_json() for user in users])
+    if users and len(users) == query.max_count:
+        response.headers['X-Next-Cursor'] = query.cursor(users[-1])
+    return response
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
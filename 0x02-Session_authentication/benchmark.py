@@ -0,0 +1,586 @@
+#!/usr/bin/env python3
+""" Benchmarks of the models
+
+Run it from this directory:
+
+    ./benchmark.py [--only NAME,...]
+
+"hashers" reports the cost of verifying a password with each hasher
+registered in models.hashers, with the work parameters of the
+environment (USER_SCRYPT_N, USER_BCRYPT_ROUNDS, ...), to size the
+authentication tier.
+
+"search" loads --objects users (10^6 by default) from a snapshot in a
+temporary directory and compares User.search by email, which uses the
+email index, with the linear scan it replaces.
+
+"memory" reports the bytes allocated per User and UserSession object,
+next to the same attributes held in an instance __dict__.
+
+"startup" times User.load_from_file on a snapshot of --objects users:
+with strptime (as before the cached parser), eagerly, and lazily
+(DB_LAZY_LOAD=1) followed by a first get.
+
+"import" creates --imports users with one save each, then with
+User.save_many, which writes the snapshot once.
+
+"write_behind" times single saves next to --existing users, written
+synchronously and with DB_WRITE_BEHIND_INTERVAL=1, including the final
+Base.flush.
+
+"threads" is a stress test: --readers threads get users and search
+sessions while --writers threads create users in batches and another
+thread keeps reloading the sessions, as SessionDBAuth does. It checks
+every result and reports the reads per second.
+
+"reload" compares UserSession.load_from_file with reload_if_changed on
+--existing sessions, unchanged and after another process appended a
+journal record.
+
+"engines" compares the get, search (by email) and save latency of the
+storage engines (STORAGE_ENGINE) holding each of --rows users. Saves
+to the file engine without journal rewrite the whole file, so only a
+few of them are timed.
+
+"snapshot" reports the size on disk, save_to_file and load_from_file
+time of a snapshot of --objects users in each DB_SNAPSHOT_FORMAT.
+
+"pages" reads --pages consecutive pages of --page-size users sorted by
+creation date from each engine holding each of --rows users: by
+sorting User.all(), with a query and offset, and with a query resuming
+after the cursor of the previous page.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from models import base, hashers, snapshot
+from models.base import DATA, TIMESTAMP_FORMAT, Base, slot_names
+from models.user import User
+from models.user_session import UserSession
+
+
+def bench_hashers(verifications: int) -> None:
+    """ Time password verification per hasher
+    """
+    print("{:>8} {:>14} {:>14}".format("hasher", "ms/verify", "verify/s"))
+    for name, hasher in hashers.HASHERS.items():
+        encoded = hasher.encode("H0lbertonSchool98!")
+        start = time.perf_counter()
+        for _ in range(verifications):
+            assert hasher.verify("H0lbertonSchool98!", encoded)
+        elapsed = (time.perf_counter() - start) / verifications
+        print("{:>8} {:>14.3f} {:>14,.1f}".format(
+            name, elapsed * 1000, 1 / elapsed))
+
+
+def write_users(objects: int) -> None:
+    """ Write a User snapshot in the current directory, one user created
+    per second
+    """
+    first = datetime(2020, 1, 1)
+    users = {}
+    for i in range(objects):
+        timestamp = (first + timedelta(seconds=i)).strftime(TIMESTAMP_FORMAT)
+        users[str(i)] = {"id": str(i), "created_at": timestamp,
+                         "updated_at": timestamp,
+                         "email": "user{}@example.com".format(i),
+                         "_password": None, "first_name": None,
+                         "last_name": None}
+    with open(User.file_path(), "w") as f:
+        json.dump(users, f)
+
+
+def bench_search(objects: int, lookups: int) -> None:
+    """ Time User.search by email, with and without the index
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            write_users(objects)
+            start = time.perf_counter()
+            User.load_from_file()
+            print("loaded {:,} users in {:.2f}s".format(
+                objects, time.perf_counter() - start))
+
+            emails = ["user{}@example.com".format(i * objects // lookups)
+                      for i in range(lookups)]
+
+            def linear(email):
+                return [user for user in DATA["User"].values()
+                        if user.email == email]
+
+            print("{:>8} {:>14} {:>14}".format("search", "ms/lookup",
+                                               "lookups/s"))
+            for name, search in (("linear", linear),
+                                 ("index", lambda email: User.search(
+                                     {"email": email}))):
+                start = time.perf_counter()
+                for email in emails:
+                    assert len(search(email)) == 1
+                elapsed = (time.perf_counter() - start) / lookups
+                print("{:>8} {:>14.4f} {:>14,.1f}".format(
+                    name, elapsed * 1000, 1 / elapsed))
+        finally:
+            os.chdir(cwd)
+
+
+def bench_startup(objects: int) -> None:
+    """ Time loading a large User snapshot
+    """
+    def strptime(value):
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+    def load(lazy=False):
+        os.environ["DB_LAZY_LOAD"] = "1" if lazy else "0"
+        User.load_from_file()
+        if lazy:
+            assert User.get(str(objects // 2)) is not None
+
+    cwd = os.getcwd()
+    lazy_load = os.environ.get("DB_LAZY_LOAD")
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            write_users(objects)
+            print("{:>10} {:>10} {:>14}".format("load", "seconds",
+                                                "objects/s"))
+            for name, run in (("strptime", load), ("eager", load),
+                              ("lazy", lambda: load(True))):
+                base.parse_timestamp.cache_clear()
+                parse_timestamp = base.parse_timestamp
+                if name == "strptime":
+                    base.parse_timestamp = strptime
+                start = time.perf_counter()
+                try:
+                    run()
+                finally:
+                    base.parse_timestamp = parse_timestamp
+                elapsed = time.perf_counter() - start
+                print("{:>10} {:>10.2f} {:>14,.0f}".format(
+                    name, elapsed, objects / elapsed))
+        finally:
+            os.chdir(cwd)
+            if lazy_load is None:
+                os.environ.pop("DB_LAZY_LOAD", None)
+            else:
+                os.environ["DB_LAZY_LOAD"] = lazy_load
+
+
+def bench_import(objects: int) -> None:
+    """ Time a bulk import, saved one by one or in a batch
+    """
+    cwd = os.getcwd()
+    print("{:>10} {:>10} {:>14}".format("import", "seconds", "objects/s"))
+    for name in ("save", "save_many"):
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                User.load_from_file()
+                users = [User(email="user{}@example.com".format(i))
+                         for i in range(objects)]
+                start = time.perf_counter()
+                if name == "save":
+                    for user in users:
+                        user.save()
+                else:
+                    User.save_many(users)
+                elapsed = time.perf_counter() - start
+                User.load_from_file()
+                assert User.count() == objects
+            finally:
+                os.chdir(cwd)
+        print("{:>10} {:>10.2f} {:>14,.0f}".format(
+            name, elapsed, objects / elapsed))
+
+
+def bench_write_behind(existing: int, saves: int) -> None:
+    """ Time the saves of a request thread, with and without write-behind
+    """
+    cwd = os.getcwd()
+    interval = os.environ.get("DB_WRITE_BEHIND_INTERVAL")
+    print("{:>10} {:>12} {:>12}".format("mode", "ms/save", "flush ms"))
+    for name, value in (("sync", "0"), ("behind", "1")):
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            os.environ["DB_WRITE_BEHIND_INTERVAL"] = value
+            try:
+                write_users(existing)
+                User.load_from_file()
+                start = time.perf_counter()
+                for i in range(saves):
+                    User(email="new{}@example.com".format(i)).save()
+                elapsed = (time.perf_counter() - start) / saves
+                start = time.perf_counter()
+                Base.flush()
+                flushed = time.perf_counter() - start
+                User.load_from_file()
+                assert User.count() == existing + saves
+            finally:
+                os.chdir(cwd)
+                if interval is None:
+                    os.environ.pop("DB_WRITE_BEHIND_INTERVAL", None)
+                else:
+                    os.environ["DB_WRITE_BEHIND_INTERVAL"] = interval
+        print("{:>10} {:>12.3f} {:>12.1f}".format(
+            name, elapsed * 1000, flushed * 1000))
+
+
+def bench_threads(objects: int, readers: int, writers: int,
+                  duration: float) -> None:
+    """ Read, write and reload concurrently, checking every result
+    """
+    cwd = os.getcwd()
+    sessions = max(objects // 10, 1)
+    errors = []
+    reads = [0] * readers
+    created = [0] * writers
+    stop = threading.Event()
+
+    def check(condition, message):
+        if not condition:
+            errors.append(message)
+
+    def read(n):
+        while not stop.is_set():
+            i = random.randrange(objects)
+            user = User.get(str(i))
+            check(user is not None and
+                  user.email == "user{}@example.com".format(i),
+                  "get user {}".format(i))
+            j = random.randrange(sessions)
+            found = UserSession.search({"session_id": "s{}".format(j)})
+            check(len(found) == 1 and found[0].user_id == str(j),
+                  "search session {}".format(j))
+            reads[n] += 2
+
+    def write(n):
+        while not stop.is_set():
+            with User.batch():
+                for _ in range(100):
+                    User(email="w{}-{}@example.com".format(
+                        n, created[n])).save()
+                    created[n] += 1
+
+    def reload():
+        while not stop.is_set():
+            UserSession.load_from_file()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            write_users(objects)
+            User.load_from_file()
+            UserSession.load_from_file()
+            UserSession.save_many(UserSession(user_id=str(j),
+                                              session_id="s{}".format(j))
+                                  for j in range(sessions))
+            threads = [threading.Thread(target=read, args=(n,))
+                       for n in range(readers)]
+            threads += [threading.Thread(target=write, args=(n,))
+                        for n in range(writers)]
+            threads.append(threading.Thread(target=reload))
+            for thread in threads:
+                thread.start()
+            time.sleep(duration)
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+            check(User.count() == objects + sum(created), "user count")
+            for n in range(writers):
+                for i in range(created[n]):
+                    check(len(User.search({"email": "w{}-{}@example.com"
+                                           .format(n, i)})) == 1,
+                          "search created user {}-{}".format(n, i))
+            User.load_from_file()
+            check(User.count() == objects + sum(created), "saved users")
+        finally:
+            os.chdir(cwd)
+    print("{:,} reads/s by {} readers, {:,} users created by {} writers, "
+          "{} errors".format(int(sum(reads) / duration), readers,
+                             sum(created), writers, len(errors)))
+    for error in errors[:10]:
+        print("  error:", error)
+
+
+def bench_reload(sessions: int, reloads: int) -> None:
+    """ Time the per-request reload of SessionDBAuth
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            UserSession.load_from_file()
+            UserSession.save_many(UserSession(user_id=str(j),
+                                              session_id="s{}".format(j))
+                                  for j in range(sessions))
+            session = UserSession(user_id="0", session_id="appended")
+
+            def append():
+                with open(UserSession.journal_path(), "a") as f:
+                    f.write(json.dumps({"op": "save",
+                                        "obj": session.to_json(True)}) + "\n")
+
+            print("{:>12} {:>12}".format("reload", "ms/request"))
+            for name, run in (
+                    ("full", UserSession.load_from_file),
+                    ("unchanged", UserSession.reload_if_changed),
+                    ("appended", lambda: (append(),
+                                          UserSession.reload_if_changed()))):
+                start = time.perf_counter()
+                for _ in range(reloads):
+                    run()
+                elapsed = (time.perf_counter() - start) / reloads
+                assert UserSession.search({"session_id": "s0"})
+                print("{:>12} {:>12.3f}".format(name, elapsed * 1000))
+        finally:
+            os.chdir(cwd)
+
+
+@contextlib.contextmanager
+def environ(**values):
+    """ Set environment variables for the duration of the block
+    """
+    previous = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def fill_users(engine: str, rows: int) -> None:
+    """ Store users as write_users does, in the current engine
+    """
+    if engine == "sqlite":
+        User.load_from_file()
+        first = datetime(2020, 1, 1)
+        User.save_many(
+            User(id=str(i), email="user{}@example.com".format(i),
+                 created_at=(first + timedelta(seconds=i)).isoformat())
+            for i in range(rows))
+    else:
+        write_users(rows)
+        User.load_from_file()
+
+
+def bench_engines(sizes: str, operations: int) -> None:
+    """ Time get, search and save per storage engine and table size
+    """
+    engines = (("file", {"STORAGE_ENGINE": "file", "DB_JOURNAL": "0"}),
+               ("journal", {"STORAGE_ENGINE": "file", "DB_JOURNAL": "1"}),
+               ("sqlite", {"STORAGE_ENGINE": "sqlite"}))
+    cwd = os.getcwd()
+    print("{:>10} {:>8} {:>12} {:>12} {:>12}".format(
+        "rows", "engine", "get ms", "search ms", "save ms"))
+    for rows in map(int, sizes.split(",")):
+        for name, variables in engines:
+            with tempfile.TemporaryDirectory() as directory:
+                os.chdir(directory)
+                variables["SQLITE_DB_PATH"] = os.path.join(directory,
+                                                           "bench.sqlite3")
+                try:
+                    with environ(**variables):
+                        fill_users(name, rows)
+                        ids = [str(random.randrange(rows))
+                               for _ in range(operations)]
+                        timings = []
+                        for run in (
+                                lambda i: User.get(i),
+                                lambda i: User.search(
+                                    {"email": "user{}@example.com"
+                                     .format(i)})[0],
+                                lambda i: User.get(i).save()):
+                            timed = ids
+                            if len(timings) == 2 and name == "file":
+                                timed = ids[:3]
+                            start = time.perf_counter()
+                            for i in timed:
+                                run(i)
+                            timings.append((time.perf_counter() - start)
+                                           / len(timed) * 1000)
+                        assert User.count() == rows
+                finally:
+                    os.chdir(cwd)
+            print("{:>10,} {:>8} {:>12.4f} {:>12.4f} {:>12.4f}".format(
+                rows, name, *timings))
+
+
+def bench_pages(sizes: str, pages: int, page_size: int) -> None:
+    """ Time reading consecutive pages of users sorted by creation date
+    """
+    def copy(number, cursor):
+        users = sorted(User.all(), key=lambda user: (user.created_at,
+                                                     user.id))
+        return users[number * page_size:(number + 1) * page_size], None
+
+    def offset(number, cursor):
+        return User.query().order_by("created_at").offset(
+            number * page_size).limit(page_size).all(), None
+
+    def after(number, cursor):
+        query = User.query().order_by("created_at").after(cursor) \
+            .limit(page_size)
+        users = query.all()
+        return users, query.cursor(users[-1])
+
+    engines = (("file", {"STORAGE_ENGINE": "file"}),
+               ("sqlite", {"STORAGE_ENGINE": "sqlite"}))
+    cwd = os.getcwd()
+    print("{:>10} {:>8} {:>12} {:>12} {:>12}".format(
+        "rows", "engine", "all() ms", "offset ms", "cursor ms"))
+    for rows in map(int, sizes.split(",")):
+        for name, variables in engines:
+            with tempfile.TemporaryDirectory() as directory:
+                os.chdir(directory)
+                variables["SQLITE_DB_PATH"] = os.path.join(directory,
+                                                           "bench.sqlite3")
+                try:
+                    with environ(**variables):
+                        fill_users(name, rows)
+                        timings = []
+                        for page in (copy, offset, after):
+                            cursor = None
+                            start = time.perf_counter()
+                            for number in range(pages):
+                                users, cursor = page(number, cursor)
+                                assert users[0].id == str(number * page_size)
+                            timings.append((time.perf_counter() - start)
+                                           / pages * 1000)
+                finally:
+                    os.chdir(cwd)
+            print("{:>10,} {:>8} {:>12.3f} {:>12.3f} {:>12.3f}".format(
+                rows, name, *timings))
+
+
+def bench_snapshot(objects: int) -> None:
+    """ Compare the snapshot formats
+    """
+    cwd = os.getcwd()
+    print("{:>8} {:>12} {:>10} {:>10} {:>10}".format(
+        "format", "bytes", "save s", "load s", "lazy s"))
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            write_users(objects)
+            User.load_from_file()
+            for name in snapshot.FORMATS:
+                with environ(DB_SNAPSHOT_FORMAT=name, DB_LAZY_LOAD="0"):
+                    start = time.perf_counter()
+                    User.save_to_file()
+                    saved = time.perf_counter() - start
+                    size = os.path.getsize(snapshot.find(User.file_path()))
+                    start = time.perf_counter()
+                    User.load_from_file()
+                    loaded = time.perf_counter() - start
+                with environ(DB_LAZY_LOAD="1"):
+                    start = time.perf_counter()
+                    User.load_from_file()
+                    lazy = time.perf_counter() - start
+                assert User.count() == objects
+                print("{:>8} {:>12,} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                    name, size, saved, loaded, lazy))
+        finally:
+            os.chdir(cwd)
+
+
+def bench_memory(objects: int) -> None:
+    """ Measure the bytes allocated per model object
+    """
+    factories = {
+        "User": lambda i: User(email="user{}@example.com".format(i),
+                               _password="scrypt$" + "x" * 64,
+                               first_name="First{}".format(i),
+                               last_name="Last{}".format(i)),
+        "UserSession": lambda i: UserSession(user_id=str(i),
+                                             session_id="s{}".format(i)),
+    }
+    print("{:>12} {:>14} {:>14}".format("model", "slots B/obj",
+                                        "__dict__ B/obj"))
+    for name, factory in factories.items():
+        sizes = []
+        for as_dict in (False, True):
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            if as_dict:
+                objs = [SimpleNamespace(**{
+                    key: getattr(obj, key) for key in slot_names(type(obj))
+                }) for obj in map(factory, range(objects))]
+            else:
+                objs = [factory(i) for i in range(objects)]
+            sizes.append((tracemalloc.get_traced_memory()[0] - before)
+                         / objects)
+            tracemalloc.stop()
+            del objs
+        print("{:>12} {:>14,.0f} {:>14,.0f}".format(name, *sizes))
+
+
+BENCHMARKS = {
+    "hashers": lambda args: bench_hashers(args.verifications),
+    "search": lambda args: bench_search(args.objects, args.lookups),
+    "memory": lambda args: bench_memory(args.memory_objects),
+    "startup": lambda args: bench_startup(args.objects),
+    "import": lambda args: bench_import(args.imports),
+    "write_behind": lambda args: bench_write_behind(args.existing,
+                                                    args.saves),
+    "threads": lambda args: bench_threads(args.existing, args.readers,
+                                          args.writers, args.duration),
+    "reload": lambda args: bench_reload(args.existing, args.reloads),
+    "engines": lambda args: bench_engines(args.rows, args.operations),
+    "snapshot": lambda args: bench_snapshot(args.objects),
+    "pages": lambda args: bench_pages(args.rows, args.pages,
+                                      args.page_size),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the models")
+    parser.add_argument("--only", default=",".join(BENCHMARKS),
+                        help="comma separated benchmarks to run")
+    parser.add_argument("--verifications", type=int, default=20,
+                        help="password verifications per hasher")
+    parser.add_argument("--objects", type=int, default=10 ** 6,
+                        help="users loaded by search and startup")
+    parser.add_argument("--lookups", type=int, default=20,
+                        help="searches per strategy")
+    parser.add_argument("--imports", type=int, default=1000,
+                        help="users created by import")
+    parser.add_argument("--existing", type=int, default=10000,
+                        help="users already saved in write_behind")
+    parser.add_argument("--saves", type=int, default=200,
+                        help="saves timed by write_behind")
+    parser.add_argument("--readers", type=int, default=8,
+                        help="reader threads of threads")
+    parser.add_argument("--writers", type=int, default=2,
+                        help="writer threads of threads")
+    parser.add_argument("--duration", type=float, default=3,
+                        help="seconds the threads benchmark runs")
+    parser.add_argument("--reloads", type=int, default=50,
+                        help="reloads timed per strategy by reload")
+    parser.add_argument("--rows", default="10000,100000",
+                        help="comma separated table sizes of engines")
+    parser.add_argument("--operations", type=int, default=1000,
+                        help="operations timed per engine and size")
+    parser.add_argument("--pages", type=int, default=20,
+                        help="consecutive pages read by pages")
+    parser.add_argument("--page-size", type=int, default=20,
+                        help="users per page of pages")
+    parser.add_argument("--memory-objects", type=int, default=100000,
+                        help="objects created per model by memory")
+    args = parser.parse_args()
+    for name in args.only.split(","):
+        BENCHMARKS[name](args)
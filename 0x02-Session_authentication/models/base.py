@@ -1,39 +1,79 @@
 #!/usr/bin/env python3
 """ Base module
+
+Objects are stored by the engine of models.storage selected by
+STORAGE_ENGINE: JSON files per class by default, or SQLite.
+
+Models declare their attributes in __slots__ so that the millions of
+objects kept in memory do not carry an instance __dict__ each.
 """
 from datetime import datetime
+from functools import lru_cache
 from typing import TypeVar, List, Iterable
-from os import path
-import json
 import uuid
 
+from models.query import Query
+from models.storage import DATA, get_storage
+
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
-DATA = {}
+
+
+def utcnow() -> datetime:
+    """ Current UTC time at the TIMESTAMP_FORMAT resolution, so objects
+    in memory sort and compare as they do once saved and loaded again
+    """
+    return datetime.utcnow().replace(microsecond=0)
+
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT date, much faster than strptime
+
+    Timestamps have a one second resolution, so the objects saved
+    together share their values and the cache hits often.
+    """
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+@lru_cache(maxsize=None)
+def slot_names(klass: type) -> tuple:
+    """ Attributes declared in the __slots__ of a class and its bases
+    """
+    names = []
+    for base in reversed(klass.__mro__):
+        slots = base.__dict__.get('__slots__', ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        names.extend(name for name in slots
+                     if name not in ('__dict__', '__weakref__'))
+    return tuple(names)
 
 
 class Base():
     """ Base class
     """
+    __slots__ = ('id', 'created_at', 'updated_at', '__weakref__')
+    INDEXED_ATTRIBUTES = ()
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
-        s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
-
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        if 'id' in kwargs:
+            self.id = kwargs['id']
+        else:
+            self.id = str(uuid.uuid4())
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = parse_timestamp(kwargs.get('created_at'))
         else:
-            self.created_at = datetime.utcnow()
+            self.created_at = utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = parse_timestamp(kwargs.get('updated_at'))
         else:
-            self.updated_at = datetime.utcnow()
+            self.updated_at = utcnow()
 
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
@@ -48,7 +88,12 @@ class Base():
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        attributes = {}
+        for key in slot_names(self.__class__):
+            if hasattr(self, key):
+                attributes[key] = getattr(self, key)
+        attributes.update(getattr(self, '__dict__', {}))
+        for key, value in attributes.items():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -57,56 +102,90 @@ class Base():
                 result[key] = value
         return result
 
+    @classmethod
+    def fields(cls) -> tuple:
+        """ Attributes stored for the objects of the class
+        """
+        return slot_names(cls)
+
+    @classmethod
+    def file_path(cls) -> str:
+        """ Path of the JSON snapshot file (".bin" instead of ".json"
+        for the binary one)
+        """
+        return ".db_{}.json".format(cls.__name__)
+
+    @classmethod
+    def journal_path(cls) -> str:
+        """ Path of the journal file
+        """
+        return ".db_{}.journal".format(cls.__name__)
+
     @classmethod
     def load_from_file(cls):
-        """ Load all objects from file
+        """ Load all objects from the storage
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
+        get_storage().load(cls)
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def reload_if_changed(cls) -> bool:
+        """ Load the objects again if another process changed them,
+        returning whether anything was loaded
+        """
+        return get_storage().reload_if_changed(cls)
 
     @classmethod
     def save_to_file(cls):
-        """ Save all objects to file
+        """ Save all objects to the storage
+        """
+        get_storage().save_all(cls)
+
+    @classmethod
+    def flush(cls):
+        """ Write the pending changes of the class and its subclasses
+        (of all classes when called on Base)
+        """
+        get_storage().flush(cls)
+
+    @classmethod
+    def batch(cls):
+        """ Context manager buffering the saves and removes of the
+        current thread, written at its end or dropped if it raises
+        """
+        return get_storage().batch()
+
+    @classmethod
+    def save_many(cls, objs: Iterable[TypeVar('Base')]):
+        """ Save objects, writing their classes once
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        with cls.batch():
+            for obj in objs:
+                obj.save()
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def remove_many(cls, objs: Iterable[TypeVar('Base')]):
+        """ Remove objects, writing their classes once
+        """
+        with cls.batch():
+            for obj in objs:
+                obj.remove()
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        self.updated_at = utcnow()
+        get_storage().save(self)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        get_storage().remove(self)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return get_storage().count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -118,20 +197,16 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return get_storage().get(cls, id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        return get_storage().search(cls, attributes)
+
+    @classmethod
+    def query(cls) -> Query:
+        """ Lazy query on the objects of the class, see models.query
+        """
+        return Query(cls)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+""" Password hashers module
+
+Stored passwords carry the name of their hasher as a prefix:
+"<hasher>$<hash>". Hashes without prefix are the legacy unsalted
+SHA-256 hex digests.
+
+New passwords are hashed with USER_PASSWORD_HASHER ("scrypt" by
+default). The work parameters are tuned per deployment with
+USER_SCRYPT_N, USER_SCRYPT_R, USER_SCRYPT_P and USER_BCRYPT_ROUNDS.
+"""
+import base64
+import hashlib
+from abc import ABC, abstractmethod
+import hmac
+import os
+import re
+from typing import Dict, Optional, Tuple
+
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+
+
+HASHERS: Dict[str, 'Hasher'] = {}
+LEGACY_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+def _b64encode(data: bytes) -> str:
+    """ Encode bytes in base64 without padding
+    """
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def _b64decode(data: str) -> bytes:
+    """ Decode base64 without padding
+    """
+    return base64.b64decode(data + '=' * (-len(data) % 4))
+
+
+class Hasher(ABC):
+    """ Base class of the password hashers
+    """
+    name = None
+
+    @abstractmethod
+    def encode(self, pwd: str) -> str:
+        """ Hash a password, returning the prefixed hash
+        """
+
+    @abstractmethod
+    def verify(self, pwd: str, encoded: str) -> bool:
+        """ Check a password against a hash of this hasher
+        """
+
+    def needs_update(self, encoded: str) -> bool:
+        """ Whether a hash was made with outdated work parameters
+        """
+        return False
+
+
+def register(hasher: Hasher) -> Hasher:
+    """ Make a hasher available under its name
+    """
+    HASHERS[hasher.name] = hasher
+    return hasher
+
+
+class SHA256Hasher(Hasher):
+    """ Unsalted SHA-256, only kept to verify legacy passwords
+    """
+    name = "sha256"
+
+    def encode(self, pwd: str) -> str:
+        """ Hash a password in SHA-256
+        """
+        return "sha256$" + hashlib.sha256(pwd.encode()).hexdigest().lower()
+
+    def verify(self, pwd: str, encoded: str) -> bool:
+        """ Compare the SHA-256 of a password with a (prefixed) digest
+        """
+        digest = encoded.split('$', 1)[-1]
+        return hmac.compare_digest(
+            hashlib.sha256(pwd.encode()).hexdigest().lower(), digest
+        )
+
+
+class ScryptHasher(Hasher):
+    """ hashlib.scrypt with a random salt per password
+    """
+    name = "scrypt"
+
+    @staticmethod
+    def params() -> Tuple[int, int, int]:
+        """ The configured (n, r, p) work parameters
+        """
+        return (int(os.getenv("USER_SCRYPT_N", 2 ** 14)),
+                int(os.getenv("USER_SCRYPT_R", 8)),
+                int(os.getenv("USER_SCRYPT_P", 1)))
+
+    @staticmethod
+    def _derive(pwd: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+        """ Run scrypt with enough memory for its parameters
+        """
+        return hashlib.scrypt(pwd.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r + 1024 * 1024, dklen=32)
+
+    def encode(self, pwd: str) -> str:
+        """ Hash a password as scrypt$n$r$p$salt$hash
+        """
+        n, r, p = self.params()
+        salt = os.urandom(16)
+        key = self._derive(pwd, salt, n, r, p)
+        return "scrypt${}${}${}${}${}".format(
+            n, r, p, _b64encode(salt), _b64encode(key)
+        )
+
+    def verify(self, pwd: str, encoded: str) -> bool:
+        """ Derive the key of a password with the stored parameters
+        """
+        try:
+            _, n, r, p, salt, key = encoded.split('$')
+            key = _b64decode(key)
+            derived = self._derive(pwd, _b64decode(salt),
+                                   int(n), int(r), int(p))
+        except ValueError:
+            # Also binascii.Error, raised by a corrupt salt or key
+            return False
+        return hmac.compare_digest(derived, key)
+
+    def needs_update(self, encoded: str) -> bool:
+        """ Whether the stored (n, r, p) differ from the configured ones
+        """
+        return tuple(int(v) for v in encoded.split('$')[1:4]) \
+            != self.params()
+
+
+class BcryptHasher(Hasher):
+    """ bcrypt, available when the bcrypt package is installed
+    """
+    name = "bcrypt"
+
+    @staticmethod
+    def rounds() -> int:
+        """ The configured bcrypt cost
+        """
+        return int(os.getenv("USER_BCRYPT_ROUNDS", 12))
+
+    def encode(self, pwd: str) -> str:
+        """ Hash a password as bcrypt$<bcrypt hash>
+        """
+        hashed = bcrypt.hashpw(pwd.encode(), bcrypt.gensalt(self.rounds()))
+        return "bcrypt$" + hashed.decode()
+
+    def verify(self, pwd: str, encoded: str) -> bool:
+        """ Check a password with bcrypt
+        """
+        try:
+            return bcrypt.checkpw(pwd.encode(),
+                                  encoded.split('$', 1)[1].encode())
+        except ValueError:
+            return False
+
+    def needs_update(self, encoded: str) -> bool:
+        """ Whether the stored cost differs from the configured one
+        """
+        return int(encoded.split('$')[3]) != self.rounds()
+
+
+register(SHA256Hasher())
+register(ScryptHasher())
+if bcrypt is not None:
+    register(BcryptHasher())
+
+
+def default_hasher() -> Hasher:
+    """ The hasher of new passwords (USER_PASSWORD_HASHER)
+    """
+    name = os.getenv("USER_PASSWORD_HASHER", "scrypt")
+    if name not in HASHERS:
+        raise ValueError("Unknown password hasher: {}".format(name))
+    return HASHERS[name]
+
+
+def identify(encoded: str) -> Optional[Hasher]:
+    """ Find the hasher of a stored password, None if unknown
+    """
+    if LEGACY_SHA256.match(encoded):
+        return HASHERS["sha256"]
+    return HASHERS.get(encoded.split('$', 1)[0])
+
+
+def make_password(pwd: str) -> str:
+    """ Hash a new password with the default hasher
+    """
+    return default_hasher().encode(pwd)
+
+
+def check_password(pwd: str, encoded: str) -> Tuple[bool, Optional[str]]:
+    """ Check a password against a stored hash
+
+    Return whether the password matches and, when it does but the hash
+    comes from another hasher or outdated parameters, the new hash to
+    store in its place.
+    """
+    hasher = identify(encoded)
+    if hasher is None or not hasher.verify(pwd, encoded):
+        return False, None
+    default = default_hasher()
+    if hasher is not default or default.needs_update(encoded):
+        return True, default.encode(pwd)
+    return True, None
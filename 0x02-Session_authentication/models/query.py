@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+""" Query module
+
+Base.query() returns a Query on the objects of a class, refined by
+chaining (each call returns a new Query):
+
+    User.query().where("created_at", "between", (start, end)) \\
+        .order_by("-created_at").limit(20)
+
+Nothing is read until the query is iterated, and iterating it yields
+the matching objects one at a time. The file engine looks candidates up
+in an index for "==" and "in" predicates on INDEXED_ATTRIBUTES; the
+SQLite engine runs the whole query in SQL.
+
+Sorted queries are ordered by their attributes then by ID, None coming
+first in ascending order. cursor(obj) encodes the position of an object
+of the results, and after(cursor) resumes a query right after it: unlike
+offset, a page is found without going through the previous ones, and
+objects saved or removed meanwhile do not shift it. Unsorted queries
+yield the objects in storage order and have no cursors.
+"""
+import base64
+import heapq
+import json
+import operator
+from operator import attrgetter, itemgetter
+from datetime import datetime
+from itertools import islice
+from typing import Iterable, Iterator, List, TypeVar
+
+from models.storage import get_storage
+
+
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda value, values: value in values,
+    "between": lambda value, bounds: bounds[0] <= value <= bounds[1],
+}
+NULLABLE_OPERATORS = ("==", "!=", "in")
+
+
+class Lowest():
+    """ Sort key of None, lower than any other value
+    """
+    __slots__ = ()
+
+    def __lt__(self, other) -> bool:
+        """ Lower than anything but itself
+        """
+        return other is not self
+
+    def __gt__(self, other) -> bool:
+        """ Greater than nothing
+        """
+        return False
+
+
+LOWEST = Lowest()
+
+
+class Descending():
+    """ Sort key wrapper reversing the order of a value
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        """ Wrap a value
+        """
+        self.value = value
+
+    def __eq__(self, other: 'Descending') -> bool:
+        """ Same value
+        """
+        return self.value == other.value
+
+    def __lt__(self, other: 'Descending') -> bool:
+        """ Greater value
+        """
+        return other.value < self.value
+
+
+def _encode_value(value):
+    """ JSON value of a sort attribute in a cursor
+    """
+    if isinstance(value, datetime):
+        return {"datetime": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    """ Sort attribute value of a cursor
+    """
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value["datetime"])
+    return value
+
+
+def _valid_value(value) -> bool:
+    """ Whether a cursor value is a single value of an attribute, not a
+    JSON array or object
+    """
+    return value is None or isinstance(value, (str, int, float, datetime))
+
+
+class Query():
+    """ Lazy query on the objects of a class
+    """
+
+    def __init__(self, model: type):
+        """ Initialize a query on all the objects of a class
+        """
+        self.model = model
+        self.predicates = ()
+        self.ordering = ()
+        self.skip_count = 0
+        self.max_count = None
+        self.after_values = None
+
+    def _copy(self, **changes) -> 'Query':
+        """ Copy of the query with some of its attributes changed
+        """
+        query = Query.__new__(Query)
+        query.__dict__.update(self.__dict__, **changes)
+        return query
+
+    def where(self, attribute: str = None, op: str = "==", value=None,
+              **attributes) -> 'Query':
+        """ Keep the objects whose attribute compares to value with op
+        ("==", "!=", "<", "<=", ">", ">=", "in" or "between" a pair of
+        bounds), and those whose attributes equal the keywords
+        """
+        if op not in OPERATORS:
+            raise ValueError("Unknown operator: {}".format(op))
+        predicates = []
+        if attribute is not None:
+            if op == "in":
+                value = tuple(value)
+            elif op == "between":
+                low, high = value
+                value = (low, high)
+            predicates.append((attribute, op, value))
+        predicates.extend((key, "==", value)
+                          for key, value in attributes.items())
+        return self._copy(predicates=self.predicates + tuple(predicates))
+
+    def order_by(self, *attributes: str) -> 'Query':
+        """ Sort by attributes, in descending order for the ones
+        prefixed with "-"
+        """
+        if self.after_values is not None:
+            raise ValueError("Sort before resuming after a cursor")
+        ordering = tuple((name.lstrip("-"), name.startswith("-"))
+                         for name in attributes)
+        return self._copy(ordering=self.ordering + ordering)
+
+    def limit(self, count: int) -> 'Query':
+        """ Yield at most count objects
+        """
+        if count is not None and count < 0:
+            raise ValueError("Negative limit: {}".format(count))
+        return self._copy(max_count=count)
+
+    def offset(self, count: int) -> 'Query':
+        """ Skip the first count objects
+        """
+        if count < 0:
+            raise ValueError("Negative offset: {}".format(count))
+        return self._copy(skip_count=count)
+
+    def after(self, cursor: str) -> 'Query':
+        """ Resume after the object of a cursor of the same ordering,
+        given by order_by beforehand
+
+        Raise ValueError if the cursor does not decode to one value per
+        sort attribute. Values of other types than the attributes raise
+        ValueError once compared to the objects, as the query is read.
+        """
+        if cursor is None:
+            return self._copy(after_values=None)
+        if not self.ordering:
+            raise ValueError("Cursors need an order_by")
+        try:
+            values = json.loads(base64.urlsafe_b64decode(
+                cursor + "=" * (-len(cursor) % 4)))
+            if not isinstance(values, list):
+                raise ValueError("Not a list")
+            values = [_decode_value(value) for value in values]
+        except (ValueError, TypeError, KeyError):
+            raise ValueError("Invalid cursor: {}".format(cursor))
+        if len(values) != len(self.sort_keys()) or \
+                not all(_valid_value(value) for value in values):
+            raise ValueError("Cursor of another ordering: {}".format(cursor))
+        return self._copy(after_values=values)
+
+    def sort_keys(self) -> tuple:
+        """ (attribute, descending) pairs the results are sorted by:
+        the ordering then the ID, or none for an unsorted query
+        """
+        if not self.ordering:
+            return ()
+        return self.ordering + (("id", False),)
+
+    def cursor(self, obj: TypeVar('Base')) -> str:
+        """ Cursor resuming the query after an object
+        """
+        if not self.ordering:
+            raise ValueError("Cursors need an order_by")
+        values = [_encode_value(getattr(obj, attribute))
+                  for attribute, _ in self.sort_keys()]
+        return base64.urlsafe_b64encode(
+            json.dumps(values).encode()).decode().rstrip("=")
+
+    def matches(self, obj: TypeVar('Base')) -> bool:
+        """ Whether an object satisfies all the predicates, None only
+        satisfying "==", "!=" and "in"
+        """
+        for attribute, op, value in self.predicates:
+            current = getattr(obj, attribute)
+            if current is None and op not in NULLABLE_OPERATORS:
+                return False
+            try:
+                if not OPERATORS[op](current, value):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    @staticmethod
+    def _key(values: Iterable, keys: tuple) -> tuple:
+        """ Sort key of the values of the sort attributes
+        """
+        key = []
+        for value, (_, descending) in zip(values, keys):
+            if value is None:
+                value = LOWEST
+            key.append(Descending(value) if descending else value)
+        return tuple(key)
+
+    def _sort_key(self, keys: tuple):
+        """ Function returning the sort key of an object: the tuple of
+        its values itself when sorted in ascending order without None
+        """
+        values = attrgetter(*(attribute for attribute, _ in keys))
+        if any(descending for _, descending in keys):
+            return lambda obj: self._key(values(obj), keys)
+
+        def sort_key(obj):
+            key = values(obj)
+            if None in key:
+                return self._key(key, keys)
+            return key
+        return sort_key
+
+    @staticmethod
+    def _after(pairs: Iterable[tuple], after: tuple) -> Iterator[tuple]:
+        """ (key, object) pairs whose key sorts after a cursor's
+
+        A cursor value of another type than its attribute raises
+        ValueError instead of the TypeError of the comparison.
+        """
+        for pair in pairs:
+            try:
+                newer = pair[0] > after
+            except TypeError:
+                raise ValueError("Cursor values of other types than the "
+                                 "sort attributes")
+            if newer:
+                yield pair
+
+    def apply(self, objs: Iterable[TypeVar('Base')]) \
+            -> Iterator[TypeVar('Base')]:
+        """ Filter, sort and paginate candidate objects
+
+        Only the first offset + limit objects are sorted when limited,
+        and the keys compared to a cursor are kept to sort them.
+        """
+        matching = filter(self.matches, objs) if self.predicates else objs
+        keys = self.sort_keys()
+        stop = None
+        if self.max_count is not None:
+            stop = self.skip_count + self.max_count
+        if keys:
+            sort_key = key_of = self._sort_key(keys)
+            keyed = self.after_values is not None
+            if keyed:
+                matching = self._after(((key_of(obj), obj)
+                                        for obj in matching),
+                                       self._key(self.after_values, keys))
+                sort_key = itemgetter(0)
+            if stop is None:
+                matching = sorted(matching, key=sort_key)
+            else:
+                matching = heapq.nsmallest(stop, matching, key=sort_key)
+            if keyed:
+                matching = (obj for _, obj in matching)
+        yield from islice(matching, self.skip_count, stop)
+
+    def __iter__(self) -> Iterator[TypeVar('Base')]:
+        """ Matching objects, read as they are yielded
+        """
+        return iter(get_storage().query(self))
+
+    def all(self) -> List[TypeVar('Base')]:
+        """ List of the matching objects
+        """
+        return list(self)
+
+    def first(self) -> TypeVar('Base'):
+        """ First matching object, None if none
+        """
+        query = self if self.max_count is not None else self.limit(1)
+        return next(iter(query), None)
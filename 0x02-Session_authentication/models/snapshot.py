@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+""" Snapshot file formats of the file storage engine
+
+"json" is the original snapshot: {"<id>": {"<attribute>": value}}.
+
+"binary" starts with MAGIC, followed by length-prefixed blocks: a JSON
+header giving the number of records and the schema (the name and
+encoding of each column), then one block per column holding the values
+of all records. Columns of strings and None are stored as UTF-8 joined
+by "\\0" (None as "\\1") and decoded with one split; any other column
+is a JSON array. Field names are stored once instead of per record,
+and building the records from the columns is the only per-record work
+left when reading.
+
+Each format has its own file: the JSON snapshot of a class keeps its
+".db_<Class>.json" name, so JSON readers and older code never find
+binary data there, and the binary one is ".db_<Class>.bin". Writing a
+snapshot removes an older file of the other format, and find returns
+the newer one if a crash (or processes writing different formats) left
+both. DB_SNAPSHOT_FORMAT selects the format written; either is read
+whatever the setting.
+"""
+import json
+import os
+import stat
+import struct
+import tempfile
+from os import getenv
+from typing import Dict, Iterable, List, Tuple
+
+FORMATS = ("json", "binary")
+EXTENSIONS = {"json": ".json", "binary": ".bin"}
+MAGIC = b"\x00BASE-SNAPSHOT-1\n"
+SEPARATOR = "\x00"
+NULL = "\x01"
+
+_LENGTH = struct.Struct("<Q")
+
+
+def snapshot_format() -> str:
+    """ Format of the snapshots written (DB_SNAPSHOT_FORMAT)
+    """
+    name = getenv("DB_SNAPSHOT_FORMAT", "json")
+    if name not in FORMATS:
+        raise ValueError("Unknown snapshot format: {}".format(name))
+    return name
+
+
+def path_of(file_path: str, snapshot: str) -> str:
+    """ Path of the snapshot of a format, given the JSON one
+    """
+    return os.path.splitext(file_path)[0] + EXTENSIONS[snapshot]
+
+
+def format_of(snapshot_path: str) -> str:
+    """ Format of a snapshot file, by its extension
+    """
+    if snapshot_path.endswith(EXTENSIONS["binary"]):
+        return "binary"
+    return "json"
+
+
+def find(file_path: str) -> str:
+    """ Path of the snapshot of either format, given the JSON one: the
+    most recently modified if both exist, None if none does
+    """
+    found = None
+    for snapshot in FORMATS:
+        snapshot_path = path_of(file_path, snapshot)
+        try:
+            mtime = os.stat(snapshot_path).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        if found is None or mtime > found[0]:
+            found = (mtime, snapshot_path)
+    return found and found[1]
+
+
+def _write_block(f, data: bytes):
+    """ Write a length-prefixed block
+    """
+    f.write(_LENGTH.pack(len(data)))
+    f.write(data)
+
+
+def _read_block(f) -> bytes:
+    """ Read a length-prefixed block
+    """
+    size, = _LENGTH.unpack(f.read(_LENGTH.size))
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated snapshot")
+    return data
+
+
+def _encode_column(values: List) -> Tuple[str, bytes]:
+    """ Encoding and bytes of the values of a column
+    """
+    nulls = False
+    for value in values:
+        if value is None:
+            nulls = True
+        elif type(value) is not str or SEPARATOR in value or value == NULL:
+            return "json", json.dumps(values).encode()
+    return ("str+null" if nulls else "str",
+            SEPARATOR.join(NULL if value is None else value
+                           for value in values).encode())
+
+
+def _decode_column(encoding: str, data: bytes, count: int) -> List:
+    """ Values of a column
+    """
+    if encoding == "json":
+        return json.loads(data)
+    if count == 0:
+        return []
+    values = data.decode().split(SEPARATOR)
+    if encoding == "str+null":
+        values = [None if value == NULL else value for value in values]
+    return values
+
+
+def dump(records: List[dict], f, fields: Iterable[str] = ()):
+    """ Write records in the binary format, with a column per field and
+    per other key of the records
+    """
+    names = list(fields)
+    known = set(names)
+    for record in records:
+        if record.keys() - known:
+            for key in record:
+                if key not in known:
+                    names.append(key)
+                    known.add(key)
+    header = {"count": len(records), "columns": []}
+    blocks = []
+    for name in names:
+        encoding, data = _encode_column([record.get(name)
+                                         for record in records])
+        header["columns"].append({"name": name, "encoding": encoding})
+        blocks.append(data)
+    f.write(MAGIC)
+    _write_block(f, json.dumps(header).encode())
+    for data in blocks:
+        _write_block(f, data)
+
+
+def load(f) -> List[dict]:
+    """ Read the records of a binary snapshot
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a binary snapshot")
+    header = json.loads(_read_block(f))
+    count = header["count"]
+    names = []
+    columns = []
+    for column in header["columns"]:
+        names.append(column["name"])
+        columns.append(_decode_column(column["encoding"], _read_block(f),
+                                      count))
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def read(snapshot_path: str) -> List[dict]:
+    """ Records of a snapshot file of either format
+    """
+    with open(snapshot_path, 'rb') as f:
+        if format_of(snapshot_path) == "binary":
+            return load(f)
+        return list(json.load(f).values())
+
+
+def _fsync_directory(directory: str):
+    """ Make the entries of a directory (a rename) durable, where the
+    platform allows it
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write(file_path: str, records: Dict[str, dict],
+          fields: Iterable[str] = (), snapshot: str = None):
+    """ Atomically replace the snapshot of a JSON snapshot path with
+    records by ID, in the DB_SNAPSHOT_FORMAT format unless given, then
+    remove an older snapshot of the other format
+
+    The records go to a temporary file of its own, so processes saving
+    the same class do not rename each other's files, which is synced to
+    disk before it replaces the snapshot: once this returns, a power
+    loss cannot bring the previous snapshot back. A new snapshot is
+    only readable by its owner, as mkstemp creates it; a replaced one
+    keeps its mode.
+    """
+    snapshot = snapshot or snapshot_format()
+    previous = find(file_path)
+    snapshot_path = path_of(file_path, snapshot)
+    directory = os.path.dirname(os.path.abspath(snapshot_path))
+    fd, temporary = tempfile.mkstemp(
+        prefix=os.path.basename(snapshot_path) + ".", suffix=".tmp",
+        dir=directory
+    )
+    try:
+        with os.fdopen(fd, 'wb' if snapshot == "binary" else 'w') as f:
+            if snapshot == "binary":
+                dump(list(records.values()), f, fields)
+            else:
+                # One write of the whole document: json.dump writes chunks
+                f.write(json.dumps(records))
+            f.flush()
+            os.fsync(f.fileno())
+        if previous is not None:
+            try:
+                os.chmod(temporary,
+                         stat.S_IMODE(os.stat(previous).st_mode))
+            except FileNotFoundError:
+                pass
+        os.replace(temporary, snapshot_path)
+    except BaseException:
+        try:
+            os.unlink(temporary)
+        except FileNotFoundError:
+            pass
+        raise
+    written = os.stat(snapshot_path).st_mtime_ns
+    for other in FORMATS:
+        if other == snapshot:
+            continue
+        other_path = path_of(file_path, other)
+        try:
+            # Kept if newer: another process writes that format
+            if os.stat(other_path).st_mtime_ns < written:
+                os.unlink(other_path)
+        except FileNotFoundError:
+            pass
+    _fsync_directory(directory)
+
+
+def convert(file_path: str, snapshot: str, fields: Iterable[str] = ()):
+    """ Rewrite the snapshot of a JSON snapshot path in another format
+    """
+    if snapshot not in FORMATS:
+        raise ValueError("Unknown snapshot format: {}".format(snapshot))
+    snapshot_path = find(file_path)
+    if snapshot_path is None:
+        return
+    records = read(snapshot_path)
+    write(file_path, {record["id"]: record for record in records}, fields,
+          snapshot)
@@ -0,0 +1,1297 @@
+#!/usr/bin/env python3
+""" Storage engines of the models
+
+Base delegates its persistence to the engine selected by
+STORAGE_ENGINE: "file" (default) or "sqlite".
+
+FileStorage keeps the objects of each class in DATA and persists them
+to ".db_<Class>.json". By default every save/remove rewrites that file.
+The snapshot is JSON, or the binary format of models.snapshot in
+".db_<Class>.bin" with DB_SNAPSHOT_FORMAT=binary; either is read
+whatever the setting, and FileStorage.convert rewrites a snapshot in
+the other format.
+
+With DB_JOURNAL=1, a save/remove instead appends one record to the
+journal ".db_<Class>.journal", and the journal is compacted into the
+snapshot file once it holds DB_JOURNAL_COMPACT_SIZE records (default
+1000). load_from_file replays the journal over the snapshot.
+Snapshots are synced to disk before they replace the previous one, so
+the journal is only emptied once they are durable. Journal records are
+appended without a sync: a process crash loses none of them, a power
+loss may lose the last ones. A record cut short by a crash is left out
+by readers and cut off by the next append; lines that do not decode to
+a record are skipped.
+
+Attributes listed in the INDEXED_ATTRIBUTES of a class are indexed in
+INDEXES, by value, for the objects saved in DATA. search looks the
+candidates up in an index when its query includes such an attribute.
+
+With DB_LAZY_LOAD=1, load_from_file only indexes the loaded records:
+DATA holds None for each of them, and the object is built from its
+record (kept in UNLOADED) on first get or search.
+
+Inside a "with Base.batch():" block, saves and removes are buffered
+for the current thread, the only one to see them. When the block exits
+they are applied to DATA and each class they touched is written once;
+if it raises they are dropped. load_from_file and reload_if_changed
+wait for the batches of other threads changing their class to end.
+
+With DB_WRITE_BEHIND_INTERVAL set to a number of seconds, saves and
+removes only mark their class dirty. A background thread rewrites the
+snapshot of the dirty classes DB_WRITE_BEHIND_INTERVAL seconds after
+the first pending change, or as soon as DB_WRITE_BEHIND_MAX_CHANGES
+changes (default 100) are pending, whichever comes first. Base.flush()
+writes them synchronously, and runs at exit. Changes still pending when
+the process dies (up to one interval or MAX_CHANGES - 1 changes) are
+lost: this is the durability window traded for faster requests.
+
+Each class has a readers-writer lock: get, search and count share it,
+save and remove take it alone, and load_from_file builds the objects
+aside and swaps them in under it, so readers never see a half-loaded
+class. A second, reentrant file lock serializes the writes of its
+files, and the changes written synchronously with them.
+
+reload_if_changed is a cheap load_from_file for data shared between
+processes: it compares the inode, size and mtime of the files with
+those recorded in FILE_STATES when they were last read or written by
+this process, and only replays the end of the journal when nothing
+else changed.
+
+SQLiteStorage keeps every class in a table of the SQLITE_DB_PATH
+database (default ".db.sqlite3"), in WAL mode so readers do not block
+the writer. The table has a TEXT column per attribute and an index per
+INDEXED_ATTRIBUTES. Nothing is held in memory but the objects in use:
+an identity map returns the same object for a row while it is
+referenced, refreshed from the row each time it is read outside a
+transaction. A batch is a transaction, and load_from_file,
+reload_if_changed, save_to_file and flush have nothing to do.
+
+Both engines run the queries of models.query: FileStorage takes the
+candidates from DATA (or an index) and lets the query filter, sort and
+paginate them, SQLiteStorage translates it to one SELECT.
+"""
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Iterable, Iterator, TypeVar, List
+from os import getenv, path
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+
+from models import snapshot
+
+
+SQLITE_DB_PATH = ".db.sqlite3"
+DATA = {}
+UNLOADED = {}
+INDEXES = {}
+JOURNAL_SIZES = {}
+FILE_STATES = {}
+
+DIRTY = {}
+BATCHES = {}
+LOCKS = {}
+ENGINES = {}
+
+_batch = threading.local()
+_locks_lock = threading.Lock()
+_materialize_lock = threading.Lock()
+_engines_lock = threading.Lock()
+_dirty = threading.Condition()
+_batches = threading.Condition()
+_flush_lock = threading.Lock()
+_flusher = None
+
+
+def journal_enabled() -> bool:
+    """ Whether saves and removes are appended to a journal
+    """
+    return getenv("DB_JOURNAL", "0").lower() in ("1", "true", "yes")
+
+
+def write_behind_interval() -> float:
+    """ Seconds a change may wait before being written, 0 to write it
+    synchronously
+    """
+    return float(getenv("DB_WRITE_BEHIND_INTERVAL", 0))
+
+
+def write_behind_max_changes() -> int:
+    """ Number of pending changes triggering an early write
+    """
+    return int(getenv("DB_WRITE_BEHIND_MAX_CHANGES", 100))
+
+
+def _write_behind():
+    """ Body of the thread writing the dirty classes
+    """
+    while True:
+        with _dirty:
+            while not DIRTY:
+                _dirty.wait()
+            deadline = time.monotonic() + write_behind_interval()
+            while DIRTY and \
+                    sum(DIRTY.values()) < write_behind_max_changes():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                _dirty.wait(remaining)
+        try:
+            FILE_STORAGE.flush(object)
+        except Exception:
+            # Kept dirty, retried after the next interval
+            time.sleep(write_behind_interval())
+
+
+def file_state(file_path: str) -> tuple:
+    """ Inode, size and modification time of a file, None if missing
+    """
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def journal_record(line: bytes) -> dict:
+    """ Journal record of a complete line, None if it is corrupt
+    """
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(entry, dict) or entry.get("op") not in \
+            ("save", "remove"):
+        return None
+    return entry
+
+
+def complete_size(f) -> int:
+    """ Size of the complete lines of a file opened for reading, up to
+    its last newline
+    """
+    position = f.seek(0, os.SEEK_END)
+    while position > 0:
+        start = max(0, position - 4096)
+        f.seek(start)
+        newline = f.read(position - start).rfind(b"\n")
+        if newline >= 0:
+            return start + newline + 1
+        position = start
+    return 0
+
+
+def lazy_load_enabled() -> bool:
+    """ Whether load_from_file defers building the objects
+    """
+    return getenv("DB_LAZY_LOAD", "0").lower() in ("1", "true", "yes")
+
+
+def journal_compact_size() -> int:
+    """ Number of journal records triggering a compaction
+    """
+    return int(getenv("DB_JOURNAL_COMPACT_SIZE", 1000))
+
+
+class RWLock():
+    """ Readers-writer lock: readers share it, a writer waits for the
+    readers and holds it alone. Waiting writers go before new readers,
+    so a reader must not acquire it again while holding it.
+    """
+
+    def __init__(self):
+        """ Initialize an unlocked lock
+        """
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writing = False
+
+    @contextmanager
+    def read(self):
+        """ Hold the lock shared
+        """
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        """ Hold the lock alone
+        """
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class Index():
+    """ Secondary hash index: ids of the saved objects per value
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index of an attribute
+        """
+        self.attribute = attribute
+        self.ids = {}
+        self.values = {}
+        self.unhashable = {}
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index an object under its current value
+        """
+        self.put(obj.id, getattr(obj, self.attribute, None))
+
+    def put(self, obj_id: str, value):
+        """ Index an object id under a value
+        """
+        self.discard(obj_id)
+        try:
+            self.ids.setdefault(value, {})[obj_id] = None
+        except TypeError:
+            # Unhashable values are candidates of every lookup
+            self.unhashable[obj_id] = None
+            return
+        self.values[obj_id] = value
+
+    def discard(self, obj_id: str):
+        """ Remove an object from the index
+        """
+        self.unhashable.pop(obj_id, None)
+        if obj_id not in self.values:
+            return
+        value = self.values.pop(obj_id)
+        ids = self.ids[value]
+        del ids[obj_id]
+        if not ids:
+            del self.ids[value]
+
+    def lookup(self, value) -> List[str]:
+        """ Ids of the objects indexed under a value
+        """
+        try:
+            ids = list(self.ids.get(value, ()))
+        except TypeError:
+            ids = []
+        return ids + list(self.unhashable)
+
+
+class Storage(ABC):
+    """ Interface of the storage engines, given the model class (or
+    object) each call is about
+    """
+
+    @abstractmethod
+    def load(self, model: type):
+        """ Load the objects of a class from the storage
+        """
+
+    @abstractmethod
+    def reload_if_changed(self, model: type) -> bool:
+        """ Load the objects again if another process changed them
+        """
+
+    @abstractmethod
+    def save_all(self, model: type):
+        """ Write all the objects of a class
+        """
+
+    @abstractmethod
+    def flush(self, model: type):
+        """ Write the pending changes of a class and its subclasses
+        """
+
+    @abstractmethod
+    def batch(self):
+        """ Context manager grouping the changes of the current thread
+        """
+
+    @abstractmethod
+    def save(self, obj: TypeVar('Base')):
+        """ Save an object
+        """
+
+    @abstractmethod
+    def remove(self, obj: TypeVar('Base')):
+        """ Remove an object
+        """
+
+    @abstractmethod
+    def count(self, model: type) -> int:
+        """ Number of objects of a class
+        """
+
+    @abstractmethod
+    def get(self, model: type, obj_id: str) -> TypeVar('Base'):
+        """ Object of a class by ID, None if missing
+        """
+
+    @abstractmethod
+    def search(self, model: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Objects of a class with matching attributes
+        """
+
+    @abstractmethod
+    def query(self, query: 'Query') -> Iterator[TypeVar('Base')]:
+        """ Objects of the class of a models.query.Query matching it
+        """
+
+
+class FileStorage(Storage):
+    """ Objects kept in DATA, persisted to a JSON file per class
+    """
+
+    @staticmethod
+    def _objects(model: type) -> dict:
+        """ Objects of a class in DATA, by ID
+        """
+        return DATA.setdefault(model.__name__, {})
+
+    @staticmethod
+    def _locks(model: type) -> tuple:
+        """ Readers-writer lock and file lock of a class
+        """
+        s_class = model.__name__
+        locks = LOCKS.get(s_class)
+        if locks is None:
+            with _locks_lock:
+                locks = LOCKS.setdefault(s_class,
+                                         (RWLock(), threading.RLock()))
+        return locks
+
+    def lock(self, model: type) -> RWLock:
+        """ Readers-writer lock of the objects of a class
+        """
+        return self._locks(model)[0]
+
+    def file_lock(self, model: type) -> threading.RLock:
+        """ Lock serializing the changes and file writes of a class
+        """
+        return self._locks(model)[1]
+
+    @staticmethod
+    def _new_indexes(model: type) -> dict:
+        """ Empty indexes of the INDEXED_ATTRIBUTES of a class
+        """
+        return {attribute: Index(attribute)
+                for attribute in model.INDEXED_ATTRIBUTES}
+
+    def indexes(self, model: type) -> dict:
+        """ Indexes of a class, by attribute
+        """
+        s_class = model.__name__
+        if s_class not in INDEXES:
+            INDEXES.setdefault(s_class, self._new_indexes(model))
+        return INDEXES[s_class]
+
+    def _load(self, model: type, obj_json: dict, lazy: bool, objs: dict,
+              unloaded: dict, indexes: dict):
+        """ Add a loaded record to objs, built now or on first use
+        """
+        if not lazy:
+            obj = model(**obj_json)
+            objs[obj.id] = obj
+            for index in indexes.values():
+                index.add(obj)
+            return
+        obj_id = obj_json['id']
+        objs[obj_id] = None
+        unloaded[obj_id] = obj_json
+        for attribute, index in indexes.items():
+            index.put(obj_id, obj_json.get(attribute))
+
+    def _materialize(self, model: type, obj_id: str) -> TypeVar('Base'):
+        """ Return an object of DATA, building it if not loaded yet
+        """
+        s_class = model.__name__
+        objs = self._objects(model)
+        obj = objs.get(obj_id)
+        if obj is None and obj_id in UNLOADED.get(s_class, {}):
+            with _materialize_lock:
+                obj = objs.get(obj_id)
+                unloaded = UNLOADED[s_class]
+                if obj is None and obj_id in unloaded:
+                    obj = model(**unloaded[obj_id])
+                    objs[obj_id] = obj
+                    del unloaded[obj_id]
+        return obj
+
+    @staticmethod
+    def _snapshot_state(model: type) -> tuple:
+        """ File state of the snapshot of a class, whatever its format
+        """
+        return file_state(snapshot.find(model.file_path()) or
+                          model.file_path())
+
+    def _read(self, model: type, lazy: bool) -> tuple:
+        """ Objects, unloaded records and indexes of the files of a class,
+        with the size and offset of its journal
+        """
+        objs, unloaded = {}, {}
+        indexes = self._new_indexes(model)
+        journal_size = 0
+        offset = 0
+        snapshot_path = snapshot.find(model.file_path())
+        if snapshot_path is not None:
+            for obj_json in snapshot.read(snapshot_path):
+                self._load(model, obj_json, lazy, objs, unloaded, indexes)
+
+        if path.exists(model.journal_path()):
+            with open(model.journal_path(), 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Being appended, or cut short by a crash and
+                        # cut off by the next append
+                        break
+                    offset += len(line)
+                    entry = journal_record(line)
+                    if entry is None:
+                        continue
+                    self._replay(model, entry, lazy, objs, unloaded,
+                                 indexes)
+                    journal_size += 1
+        return objs, unloaded, indexes, journal_size, offset
+
+    def load(self, model: type):
+        """ Load all objects from file, then replay the journal, once the
+        batches of other threads changing the class have ended
+        """
+        self._wait_batches(model)
+        self._load_files(model)
+
+    def _load_files(self, model: type):
+        """ Load all objects from file, then replay the journal
+        """
+        s_class = model.__name__
+        lazy = lazy_load_enabled()
+        with self.file_lock(model):
+            while True:
+                # Write-behind changes only in memory would be lost
+                self._write_dirty(model)
+                # Taken before reading: a change made meanwhile shows
+                states = (self._snapshot_state(model),
+                          file_state(model.journal_path()))
+                objs, unloaded, indexes, journal_size, offset = \
+                    self._read(model, lazy)
+
+                with self.lock(model).write():
+                    if model in DIRTY:
+                        # Changed while loading: write it and load again
+                        continue
+                    DATA[s_class] = objs
+                    UNLOADED[s_class] = unloaded
+                    INDEXES[s_class] = indexes
+                    JOURNAL_SIZES[s_class] = journal_size
+                    FILE_STATES[s_class] = {"snapshot": states[0],
+                                            "journal": states[1],
+                                            "offset": offset}
+                    return
+
+    def reload_if_changed(self, model: type) -> bool:
+        """ Load the objects again if another process changed the files
+
+        When only the journal grew, the records appended since it was
+        last read are replayed. Return whether anything was loaded.
+        """
+        s_class = model.__name__
+        self._wait_batches(model)
+        with self.file_lock(model):
+            state = FILE_STATES.get(s_class)
+            snapshot = self._snapshot_state(model)
+            journal = file_state(model.journal_path())
+            if state is not None and DATA.get(s_class) is not None:
+                if state["snapshot"] == snapshot and \
+                        state["journal"] == journal:
+                    return False
+                previous = state["journal"]
+                appended = journal is not None \
+                    and (previous or journal)[0] == journal[0] \
+                    and journal[1] >= state["offset"]
+                if appended and state["snapshot"] == snapshot and \
+                        model not in DIRTY:
+                    self._replay_tail(model, journal)
+                    return True
+            self._load_files(model)
+            return True
+
+    def _replay_tail(self, model: type, journal: tuple):
+        """ Replay the journal records appended after FILE_STATES offset
+        """
+        s_class = model.__name__
+        state = FILE_STATES[s_class]
+        with open(model.journal_path(), 'rb') as f:
+            f.seek(state["offset"])
+            lines = f.read().splitlines(True)
+        entries = []
+        for line in lines:
+            if not line.endswith(b"\n"):
+                # Still being appended, replayed by a later reload
+                break
+            state["offset"] += len(line)
+            entry = journal_record(line)
+            if entry is not None:
+                entries.append(entry)
+        lazy = lazy_load_enabled()
+        with self.lock(model).write():
+            for entry in entries:
+                self._replay(model, entry, lazy, self._objects(model),
+                             UNLOADED.setdefault(s_class, {}),
+                             self.indexes(model))
+        JOURNAL_SIZES[s_class] = JOURNAL_SIZES.get(s_class, 0) + \
+            len(entries)
+        state["journal"] = journal
+
+    def _replay(self, model: type, entry: dict, lazy: bool, objs: dict,
+                unloaded: dict, indexes: dict):
+        """ Apply one journal record to the objects being loaded
+        """
+        if entry["op"] == "save":
+            unloaded.pop(entry["obj"]["id"], None)
+            self._load(model, entry["obj"], lazy, objs, unloaded, indexes)
+        elif entry["op"] == "remove":
+            objs.pop(entry["id"], None)
+            unloaded.pop(entry["id"], None)
+            for index in indexes.values():
+                index.discard(entry["id"])
+
+    def save_all(self, model: type):
+        """ Save all objects to file
+
+        The snapshot is written to a temporary file renamed over the
+        previous one, then the journal it now includes is emptied.
+        """
+        s_class = model.__name__
+        with self.file_lock(model):
+            with self.lock(model).read():
+                items = list(self._objects(model).items())
+                unloaded = dict(UNLOADED.get(s_class, {}))
+            objs_json = {}
+            for obj_id, obj in items:
+                if obj is None:
+                    objs_json[obj_id] = unloaded[obj_id]
+                else:
+                    objs_json[obj_id] = obj.to_json(True)
+
+            snapshot.write(model.file_path(), objs_json, model.fields())
+
+            if JOURNAL_SIZES.get(s_class) or \
+                    path.exists(model.journal_path()):
+                open(model.journal_path(), 'w').close()
+            JOURNAL_SIZES[s_class] = 0
+            FILE_STATES[s_class] = {
+                "snapshot": self._snapshot_state(model),
+                "journal": file_state(model.journal_path()),
+                "offset": 0
+            }
+
+    def convert(self, model: type, snapshot_format: str):
+        """ Rewrite the snapshot of a class in a format ("json" or
+        "binary"), keeping its journal
+        """
+        with self.file_lock(model):
+            snapshot.convert(model.file_path(), snapshot_format,
+                             model.fields())
+            state = FILE_STATES.get(model.__name__)
+            if state is not None:
+                state["snapshot"] = self._snapshot_state(model)
+
+    def _append_journal(self, model: type, entry: dict):
+        """ Append a record to the journal, compacting it when full
+
+        A last record cut short by a crash is cut off first, so the new
+        record starts a line of its own instead of making that line
+        corrupt.
+        """
+        s_class = model.__name__
+        line = (json.dumps(entry) + "\n").encode()
+        with self.file_lock(model):
+            state = FILE_STATES.get(s_class)
+            with open(model.journal_path(), 'ab+') as f:
+                end = f.seek(0, os.SEEK_END)
+                size = complete_size(f)
+                if size != end:
+                    f.truncate(size)
+                f.write(line)
+            journal = file_state(model.journal_path())
+            if state is not None and journal[1] == state["offset"] + \
+                    len(line) and (state["journal"] or journal)[0] \
+                    == journal[0]:
+                # Nothing else appended since it was read: skip our record
+                state["journal"] = journal
+                state["offset"] += len(line)
+            JOURNAL_SIZES[s_class] = JOURNAL_SIZES.get(s_class, 0) + 1
+            if JOURNAL_SIZES[s_class] >= journal_compact_size():
+                self.save_all(model)
+
+    @staticmethod
+    def _deferring() -> bool:
+        """ Whether changes are written later, by write-behind
+        """
+        return write_behind_interval() > 0
+
+    def _change_lock(self, model: type):
+        """ Lock to hold while changing DATA and writing the change
+        """
+        if self._deferring():
+            return nullcontext()
+        return self.file_lock(model)
+
+    def _defer(self, model: type) -> bool:
+        """ Record a change of DATA for the write-behind thread, if not
+        written synchronously
+        """
+        if not self._deferring():
+            return False
+        self._mark_dirty(model)
+        return True
+
+    @staticmethod
+    def _buffer(model: type) -> dict:
+        """ Changes of a class buffered by the batch of the current
+        thread, registered in BATCHES with the first one
+        """
+        changes = _batch.changes.get(model)
+        if changes is None:
+            with _batches:
+                BATCHES[model] = BATCHES.get(model, 0) + 1
+            changes = _batch.changes[model] = {}
+        return changes
+
+    @staticmethod
+    def _release(classes: Iterable[type]):
+        """ Unregister the classes of an ended batch from BATCHES
+        """
+        with _batches:
+            for model in classes:
+                BATCHES[model] -= 1
+                if not BATCHES[model]:
+                    del BATCHES[model]
+            _batches.notify_all()
+
+    @staticmethod
+    def _wait_batches(model: type):
+        """ Wait until no batch has changes of a class, unless in a batch
+        (which could be the one waited for, or wait for this one)
+        """
+        if getattr(_batch, 'depth', 0):
+            return
+        with _batches:
+            while model in BATCHES:
+                _batches.wait()
+
+    @staticmethod
+    def _pending(model: type) -> dict:
+        """ Changes of a class buffered by the batch of the current
+        thread: objects saved, None for those removed, by ID
+        """
+        if not getattr(_batch, 'depth', 0):
+            return None
+        return _batch.changes.get(model)
+
+    def _persist(self, model: type, entry: dict):
+        """ Write a change of DATA
+        """
+        if journal_enabled():
+            self._append_journal(model, entry)
+        else:
+            self.save_all(model)
+
+    @staticmethod
+    def _mark_dirty(model: type):
+        """ Count a pending change, for the write-behind thread
+        """
+        global _flusher
+
+        with _dirty:
+            DIRTY[model] = DIRTY.get(model, 0) + 1
+            if _flusher is None:
+                _flusher = threading.Thread(target=_write_behind,
+                                            name="write-behind", daemon=True)
+                _flusher.start()
+            _dirty.notify()
+
+    def flush(self, model: type):
+        """ Write the pending changes of the class and its subclasses
+        """
+        with _flush_lock:
+            with _dirty:
+                classes = [klass for klass in DIRTY
+                           if issubclass(klass, model)]
+            for klass in classes:
+                with self.file_lock(klass):
+                    self._write_dirty(klass)
+
+    def _write_dirty(self, model: type):
+        """ Write a class if it has pending write-behind changes, under
+        its file lock
+        """
+        with _dirty:
+            changes = DIRTY.pop(model, 0)
+        if not changes:
+            return
+        try:
+            self.save_all(model)
+        except Exception:
+            with _dirty:
+                DIRTY[model] = DIRTY.get(model, 0) + changes
+            raise
+
+    @contextmanager
+    def batch(self):
+        """ Buffer the saves and removes of the current thread
+
+        The changes are kept aside, seen by the reads of this thread
+        only. At the end of the block they are applied to DATA and each
+        class they touch is written once, under its file lock. If the
+        block raises they are dropped, and the objects of DATA it saved
+        are replaced by their state in the files, as they may have been
+        changed in place. Nested blocks belong to the outermost one.
+        Pending write-behind changes are written first, so they are in
+        the files a rollback reads. The classes with buffered changes are
+        registered in BATCHES until the end of the block, and loading
+        them from another thread waits for it.
+        """
+        depth = getattr(_batch, 'depth', 0)
+        if depth == 0:
+            if DIRTY:
+                self.flush(object)
+            _batch.changes = {}
+            _batch.saved = {}
+        _batch.depth = depth + 1
+        try:
+            yield
+        except BaseException:
+            if depth == 0:
+                _batch.depth = 0
+                saved, _batch.saved = _batch.saved, {}
+                changes, _batch.changes = _batch.changes, {}
+                try:
+                    for klass, objs in saved.items():
+                        self._restore(klass, objs)
+                finally:
+                    self._release(changes)
+            raise
+        finally:
+            _batch.depth = depth
+        if depth == 0:
+            changes, _batch.changes = _batch.changes, {}
+            _batch.saved = {}
+            try:
+                for klass, objs in changes.items():
+                    self._apply(klass, objs)
+            finally:
+                self._release(changes)
+
+    def _apply(self, model: type, changes: dict):
+        """ Apply the changes of a batch to DATA and write the class
+        """
+        s_class = model.__name__
+        with self.file_lock(model):
+            with self.lock(model).write():
+                objs = self._objects(model)
+                unloaded = UNLOADED.get(s_class, {})
+                indexes = self.indexes(model)
+                for obj_id, obj in changes.items():
+                    unloaded.pop(obj_id, None)
+                    if obj is None:
+                        objs.pop(obj_id, None)
+                        for index in indexes.values():
+                            index.discard(obj_id)
+                    else:
+                        objs[obj_id] = obj
+                        for index in indexes.values():
+                            index.add(obj)
+            self.save_all(model)
+
+    def _restore(self, model: type, saved: dict):
+        """ Replace the objects of DATA saved by a rolled back batch with
+        their state in the files
+        """
+        with self.file_lock(model):
+            with self.lock(model).read():
+                objs = self._objects(model)
+                saved = [obj for obj in saved.values()
+                         if objs.get(obj.id) is obj]
+            if not saved:
+                return
+            records = self._read(model, True)[1]
+            with self.lock(model).write():
+                for obj in saved:
+                    if objs.get(obj.id) is not obj or \
+                            obj.id not in records:
+                        continue
+                    restored = model(**records[obj.id])
+                    objs[obj.id] = restored
+                    for index in self.indexes(model).values():
+                        index.add(restored)
+
+    def save(self, obj: TypeVar('Base')):
+        """ Save an object in DATA and write it
+        """
+        model = obj.__class__
+        s_class = model.__name__
+        if getattr(_batch, 'depth', 0):
+            self._buffer(model)[obj.id] = obj
+            _batch.saved.setdefault(model, {})[obj.id] = obj
+            return
+        with self._change_lock(model):
+            with self.lock(model).write():
+                self._objects(model)[obj.id] = obj
+                UNLOADED.get(s_class, {}).pop(obj.id, None)
+                for index in self.indexes(model).values():
+                    index.add(obj)
+                deferred = self._defer(model)
+            if not deferred:
+                self._persist(model, {"op": "save", "obj": obj.to_json(True)})
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Remove an object from DATA and write it
+        """
+        model = obj.__class__
+        if getattr(_batch, 'depth', 0):
+            self._buffer(model)[obj.id] = None
+            return
+        with self._change_lock(model):
+            with self.lock(model).write():
+                if self._materialize(model, obj.id) is None:
+                    return
+                del self._objects(model)[obj.id]
+                for index in self.indexes(model).values():
+                    index.discard(obj.id)
+                deferred = self._defer(model)
+            if not deferred:
+                self._persist(model, {"op": "remove", "id": obj.id})
+
+    def count(self, model: type) -> int:
+        """ Number of objects of a class in DATA
+        """
+        pending = self._pending(model) or {}
+        with self.lock(model).read():
+            objs = self._objects(model)
+            count = len(objs)
+            for obj_id, obj in pending.items():
+                count += (obj is not None) - (obj_id in objs)
+            return count
+
+    def get(self, model: type, obj_id: str) -> TypeVar('Base'):
+        """ Object of DATA by ID
+        """
+        pending = self._pending(model)
+        if pending and obj_id in pending:
+            return pending[obj_id]
+        with self.lock(model).read():
+            return self._materialize(model, obj_id)
+
+    def _overlay(self, model: type, objs) -> list:
+        """ Objects of DATA as the batch of the current thread changes
+        them
+        """
+        pending = self._pending(model)
+        if not pending:
+            return list(objs)
+        return [obj for obj in objs if obj.id not in pending] + \
+            [obj for obj in pending.values() if obj is not None]
+
+    def search(self, model: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+
+        When an attribute of the query is indexed, only the objects saved
+        with that value are checked, so an object changed since its last
+        save is found by the values it has both saved and in memory.
+        """
+        s_class = model.__name__
+
+        def _search(obj):
+            if len(attributes) == 0:
+                return True
+            for k, v in attributes.items():
+                if (getattr(obj, k) != v):
+                    return False
+            return True
+
+        with self.lock(model).read():
+            ids = None
+            indexes = self.indexes(model)
+            for attribute in attributes:
+                if attribute in indexes:
+                    ids = indexes[attribute].lookup(attributes[attribute])
+                    break
+            if ids is not None:
+                objs = [self._materialize(model, obj_id) for obj_id in ids]
+            else:
+                if UNLOADED.get(s_class):
+                    for obj_id in list(UNLOADED[s_class]):
+                        self._materialize(model, obj_id)
+                objs = self._objects(model).values()
+            objs = self._overlay(model, objs)
+            return list(filter(_search, objs))
+
+    def query(self, query: 'Query') -> Iterator[TypeVar('Base')]:
+        """ Objects of DATA matching a query
+
+        The candidates are the objects of an index for an "==" or "in"
+        predicate on an indexed attribute, else all of them, taken
+        under the read lock and then filtered, sorted and paginated by
+        the query as they are yielded.
+        """
+        model = query.model
+        s_class = model.__name__
+        with self.lock(model).read():
+            ids = None
+            indexes = self.indexes(model)
+            for attribute, op, value in query.predicates:
+                if attribute in indexes and op in ("==", "in"):
+                    index = indexes[attribute]
+                    if op == "==":
+                        ids = index.lookup(value)
+                    else:
+                        ids = list(dict.fromkeys(
+                            obj_id for one in value
+                            for obj_id in index.lookup(one)))
+                    break
+            if ids is not None:
+                objs = [self._materialize(model, obj_id) for obj_id in ids]
+            else:
+                if UNLOADED.get(s_class):
+                    for obj_id in list(UNLOADED[s_class]):
+                        self._materialize(model, obj_id)
+                objs = self._objects(model).values()
+            objs = self._overlay(model, objs)
+        return query.apply(objs)
+
+
+def _sql_value(value):
+    """ Value of a query parameter as stored by to_json(True)
+    """
+    if isinstance(value, datetime):
+        return value.isoformat(timespec='seconds')
+    return value
+
+
+class SQLiteStorage(Storage):
+    """ Objects stored in an SQLite database, a table per class
+    """
+
+    def __init__(self, db_path: str):
+        """ Initialize the engine of a database file
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._tables = {}
+        self._tables_lock = threading.Lock()
+        self._identities = {}
+
+    def connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread, in autocommit mode
+        """
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, isolation_level=None,
+                                 timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.depth = 0
+        return db
+
+    def columns(self, model: type) -> tuple:
+        """ Columns of the table of a class, creating it on first use
+        """
+        columns = self._tables.get(model)
+        if columns is not None:
+            return columns
+        with self._tables_lock:
+            if model in self._tables:
+                return self._tables[model]
+            columns = tuple(model.fields())
+            table = model.__name__
+            db = self.connection()
+            db.execute('CREATE TABLE IF NOT EXISTS "{}" ({})'.format(
+                table, ", ".join(
+                    '"{}" TEXT{}'.format(
+                        column, " PRIMARY KEY" if column == "id" else "")
+                    for column in columns)))
+            for attribute in model.INDEXED_ATTRIBUTES:
+                db.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" ON "{0}" '
+                           '("{1}")'.format(table, attribute))
+            self._identities[model] = weakref.WeakValueDictionary()
+            self._tables[model] = columns
+        return columns
+
+    def _object(self, model: type, columns: tuple,
+                row: tuple) -> TypeVar('Base'):
+        """ Object of a row, the one already in use if any
+
+        Outside a transaction, the object in use is refreshed from the
+        row, which another process may have changed: its attributes not
+        saved yet are overwritten.
+        """
+        identities = self._identities[model]
+        obj = identities.get(row[0])
+        if obj is not None and getattr(self._local, 'depth', 0):
+            return obj
+        fresh = model(**dict(zip(columns, row)))
+        if obj is None:
+            return identities.setdefault(fresh.id, fresh)
+        for column in columns:
+            setattr(obj, column, getattr(fresh, column))
+        return obj
+
+    def _select(self, model: type, where: str = "",
+                params: tuple = ()) -> List[TypeVar('Base')]:
+        """ Objects of the rows of a class matching a WHERE clause
+        """
+        return list(self._iter_select(model, where, params))
+
+    def _iter_select(self, model: type, where: str = "", params: tuple = (),
+                     order: str = "rowid",
+                     limit: str = "") -> Iterator[TypeVar('Base')]:
+        """ Objects of the rows of a class matching a WHERE clause, built
+        as the rows are fetched
+        """
+        columns = self.columns(model)
+        rows = self.connection().execute(
+            'SELECT {} FROM "{}" {} ORDER BY {} {}'.format(
+                ", ".join('"{}"'.format(column) for column in columns),
+                model.__name__, where, order, limit), params)
+        for row in rows:
+            yield self._object(model, columns, row)
+
+    @staticmethod
+    def _column(model: type, columns: tuple, attribute: str) -> str:
+        """ Quoted column of an attribute
+        """
+        if attribute not in columns:
+            raise AttributeError("'{}' object has no attribute '{}'"
+                                 .format(model.__name__, attribute))
+        return '"{}"'.format(attribute)
+
+    def load(self, model: type):
+        """ Nothing to load: rows are read when queried
+        """
+        self.columns(model)
+
+    def reload_if_changed(self, model: type) -> bool:
+        """ Nothing to reload: rows are read when queried
+        """
+        self.columns(model)
+        return False
+
+    def save_all(self, model: type):
+        """ Nothing to write: rows are written on save
+        """
+
+    def flush(self, model: type):
+        """ Nothing pending: rows are written on save
+        """
+
+    def _touch(self, model: type, obj_id: str):
+        """ Record an object changed by the transaction of the current
+        thread
+        """
+        if getattr(self._local, 'depth', 0):
+            self._local.touched.setdefault(model, set()).add(obj_id)
+
+    def _evict(self, touched: dict):
+        """ Drop the objects of a rolled back transaction from the
+        identity map
+        """
+        for model, ids in touched.items():
+            identities = self._identities[model]
+            for obj_id in ids:
+                identities.pop(obj_id, None)
+
+    @contextmanager
+    def batch(self):
+        """ Run the changes of the current thread in a transaction,
+        rolled back if the block raises
+
+        The objects it saved or removed are then evicted from the
+        identity map, so their rows are read again instead of returning
+        the objects as they were changed.
+        """
+        db = self.connection()
+        depth = self._local.depth
+        if depth == 0:
+            db.execute("BEGIN IMMEDIATE")
+            self._local.touched = {}
+        self._local.depth = depth + 1
+        try:
+            yield
+        except BaseException:
+            if depth == 0:
+                db.execute("ROLLBACK")
+                self._evict(self._local.touched)
+            raise
+        finally:
+            self._local.depth = depth
+        if depth == 0:
+            db.execute("COMMIT")
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update the row of an object
+        """
+        model = obj.__class__
+        columns = self.columns(model)
+        values = obj.to_json(True)
+        self.connection().execute(
+            'INSERT INTO "{0}" ({1}) VALUES ({2}) ON CONFLICT(id) DO '
+            'UPDATE SET {3}'.format(
+                model.__name__,
+                ", ".join('"{}"'.format(column) for column in columns),
+                ", ".join("?" * len(columns)),
+                ", ".join('"{0}" = excluded."{0}"'.format(column)
+                          for column in columns if column != "id")),
+            [values.get(column) for column in columns])
+        self._identities[model][obj.id] = obj
+        self._touch(model, obj.id)
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete the row of an object
+        """
+        model = obj.__class__
+        self.columns(model)
+        self.connection().execute(
+            'DELETE FROM "{}" WHERE id = ?'.format(model.__name__),
+            (obj.id,))
+        self._identities[model].pop(obj.id, None)
+        self._touch(model, obj.id)
+
+    def count(self, model: type) -> int:
+        """ Number of rows of a class
+        """
+        self.columns(model)
+        return self.connection().execute(
+            'SELECT COUNT(*) FROM "{}"'.format(model.__name__)).fetchone()[0]
+
+    def get(self, model: type, obj_id: str) -> TypeVar('Base'):
+        """ Object of a row by ID
+        """
+        objs = self._select(model, "WHERE id = ?", (obj_id,))
+        return objs[0] if objs else None
+
+    def search(self, model: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Objects whose columns equal the attributes
+        """
+        columns = self.columns(model)
+        conditions = []
+        params = []
+        for attribute, value in attributes.items():
+            column = self._column(model, columns, attribute)
+            if value is None:
+                conditions.append('{} IS NULL'.format(column))
+            else:
+                conditions.append('{} = ?'.format(column))
+                params.append(_sql_value(value))
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        return self._select(model, where, tuple(params))
+
+    def query(self, query: 'Query') -> Iterator[TypeVar('Base')]:
+        """ Rows matching a query, selected, sorted and paginated in SQL
+
+        "==" and "!=" compare with IS and IS NOT to match None as the
+        file engine does, and SQLite sorts NULL first in ascending order
+        as the query does. The rows after a cursor are those greater on
+        the first sort key, or equal on it and greater on the next, etc.
+        """
+        model = query.model
+        columns = self.columns(model)
+        conditions = []
+        params = []
+        for attribute, op, value in query.predicates:
+            column = self._column(model, columns, attribute)
+            if op == "in":
+                values = [_sql_value(one) for one in value if one is not None]
+                condition = '{} IN ({})'.format(column,
+                                                ", ".join("?" * len(values)))
+                if len(values) != len(value):
+                    condition = '({} OR {} IS NULL)'.format(condition, column)
+                conditions.append(condition)
+                params.extend(values)
+            elif op == "between":
+                conditions.append('{} BETWEEN ? AND ?'.format(column))
+                params.extend(_sql_value(one) for one in value)
+            else:
+                sql_op = {"==": "IS", "!=": "IS NOT"}.get(op, op)
+                conditions.append('{} {} ?'.format(column, sql_op))
+                params.append(_sql_value(value))
+        keys = query.sort_keys()
+        if query.after_values is not None:
+            alternatives = []
+            for i, (attribute, descending) in enumerate(keys):
+                column = self._column(model, columns, attribute)
+                value = _sql_value(query.after_values[i])
+                if value is None and descending:
+                    continue
+                terms = ['"{}" IS ?'.format(previous)
+                         for previous, _ in keys[:i]]
+                alternative = [_sql_value(previous)
+                               for previous in query.after_values[:i]]
+                if value is None:
+                    terms.append('{} IS NOT NULL'.format(column))
+                elif descending:
+                    terms.append('({0} < ? OR {0} IS NULL)'.format(column))
+                    alternative.append(value)
+                else:
+                    terms.append('{} > ?'.format(column))
+                    alternative.append(value)
+                alternatives.append("(" + " AND ".join(terms) + ")")
+                params.extend(alternative)
+            conditions.append("(" + (" OR ".join(alternatives) or "0") + ")")
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        order = "rowid"
+        if keys:
+            order = ", ".join('{} {}'.format(
+                self._column(model, columns, attribute),
+                "DESC" if descending else "ASC")
+                for attribute, descending in keys)
+        limit = ""
+        if query.max_count is not None or query.skip_count:
+            limit = "LIMIT ? OFFSET ?"
+            params.extend((-1 if query.max_count is None
+                           else query.max_count, query.skip_count))
+        return self._iter_select(model, where, tuple(params), order, limit)
+
+
+FILE_STORAGE = FileStorage()
+
+
+def get_storage() -> Storage:
+    """ Engine selected by STORAGE_ENGINE ("file" or "sqlite")
+    """
+    engine = getenv("STORAGE_ENGINE", "file")
+    if engine == "file":
+        return FILE_STORAGE
+    if engine != "sqlite":
+        raise ValueError("Unknown storage engine: {}".format(engine))
+    db_path = getenv("SQLITE_DB_PATH", SQLITE_DB_PATH)
+    key = (engine, os.path.abspath(db_path))
+    storage = ENGINES.get(key)
+    if storage is None:
+        with _engines_lock:
+            storage = ENGINES.setdefault(key, SQLiteStorage(key[1]))
+    return storage
+
+
+atexit.register(FILE_STORAGE.flush, object)
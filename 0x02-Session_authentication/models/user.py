@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 """ User module
 """
-import hashlib
 from models.base import Base
+from models.hashers import check_password, make_password
 
 
 class User(Base):
     """ User class
     """
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+    INDEXED_ATTRIBUTES = ('email',)
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
@@ -26,22 +28,30 @@ class User(Base):
 
     @password.setter
     def password(self, pwd: str):
-        """ Setter of a new password: encrypt in SHA256
+        """ Setter of a new password: hash it with the default hasher
         """
         if pwd is None or type(pwd) is not str:
             self._password = None
         else:
-            self._password = hashlib.sha256(pwd.encode()).hexdigest().lower()
+            self._password = make_password(pwd)
 
     def is_valid_password(self, pwd: str) -> bool:
         """ Validate a password
+
+        A stored user whose password was hashed with another hasher
+        (e.g. legacy SHA-256) or outdated parameters gets it rehashed
+        with the default hasher on a successful validation.
         """
         if pwd is None or type(pwd) is not str:
             return False
         if self.password is None:
             return False
-        pwd_e = pwd.encode()
-        return hashlib.sha256(pwd_e).hexdigest().lower() == self.password
+        valid, upgraded = check_password(pwd, self.password)
+        if valid and upgraded is not None:
+            self._password = upgraded
+            if self.__class__.get(self.id) is self:
+                self.save()
+        return valid
 
     def display_name(self) -> str:
         """ Display User name based on email/first_name/last_name
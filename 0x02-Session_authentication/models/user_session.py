@@ -6,6 +6,8 @@ from models.base import Base
 
 class UserSession(Base):
     """User Session Class to store session data"""
+    __slots__ = ('user_id', 'session_id')
+    INDEXED_ATTRIBUTES = ('session_id', 'user_id')
 
     def __init__(self, *args: list, **kwargs: dict):
         """Initialize a UserSession instance"""
@@ -2,6 +2,10 @@
 """
 Auth module
 """
+import json
+import os
+import platform
+import time
 import uuid
 import bcrypt
 from db import DB
@@ -9,6 +13,16 @@ from user import User
 from sqlalchemy.orm.exc import NoResultFound
 from typing import Optional
 
+BCRYPT_MIN_ROUNDS = 4
+BCRYPT_MAX_ROUNDS = 31
+BCRYPT_PROBE_ROUNDS = 8
+BCRYPT_FLOOR_ROUNDS = 12
+BCRYPT_LOWEST_FLOOR = 10
+LATENCY_BUDGET_MS = 250.0
+CALIBRATION_FILE = ".bcrypt_calibration.json"
+
+_rounds = None
+
 
 class Auth:
     """Auth class to interact with the authentication database."""
@@ -82,9 +96,106 @@ class Auth:
             raise ValueError("Invalid reset token")
 
 
+def _measure_rounds(rounds: int, samples: int = 3) -> float:
+    """Returns the fastest of `samples` bcrypt hashes at a cost, in ms."""
+    salt = bcrypt.gensalt(rounds)
+    best = float("inf")
+    for _ in range(samples):
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration password", salt)
+        best = min(best, (time.perf_counter() - start) * 1000)
+    return best
+
+
+def _rounds_floor() -> int:
+    """
+    Returns the lowest cost calibrate_rounds may pick:
+    BCRYPT_ROUNDS_FLOOR (default 12, bcrypt's own default), which must
+    lie between 10 and 31.
+    """
+    floor = int(os.getenv("BCRYPT_ROUNDS_FLOOR", BCRYPT_FLOOR_ROUNDS))
+    if not BCRYPT_LOWEST_FLOOR <= floor <= BCRYPT_MAX_ROUNDS:
+        raise ValueError("BCRYPT_ROUNDS_FLOOR must be between {} and {}"
+                         .format(BCRYPT_LOWEST_FLOOR, BCRYPT_MAX_ROUNDS))
+    return floor
+
+
+def calibrate_rounds(budget_ms: Optional[float] = None,
+                     cache_path: Optional[str] = None) -> int:
+    """
+    Picks the highest bcrypt cost hashing within the latency budget
+    (BCRYPT_LATENCY_BUDGET_MS, default 250 ms) on this host, but never
+    below the security floor, which wins over the budget on slow hosts.
+
+    The time of a cheap probe is doubled per extra round to find the
+    candidate, which is then measured once to confirm it. The result is
+    cached in BCRYPT_CALIBRATION_FILE and reused for the same host and
+    budget, unless the cached cost lies outside [floor, 31].
+
+    This is the calibrate() of 0x00-personal_data/encrypt_password.py:
+    the projects are deployed on their own and share no package.
+    """
+    global _rounds
+
+    if budget_ms is None:
+        budget_ms = float(os.getenv("BCRYPT_LATENCY_BUDGET_MS",
+                                    LATENCY_BUDGET_MS))
+    if cache_path is None:
+        cache_path = os.getenv("BCRYPT_CALIBRATION_FILE", CALIBRATION_FILE)
+    host = platform.node()
+    floor = _rounds_floor()
+
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached.get("host") == host and \
+                cached.get("budget_ms") == budget_ms:
+            rounds = int(cached["rounds"])
+            if floor <= rounds <= BCRYPT_MAX_ROUNDS:
+                _rounds = rounds
+                return _rounds
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        pass
+
+    rounds = BCRYPT_PROBE_ROUNDS
+    elapsed = _measure_rounds(rounds)
+    while rounds < BCRYPT_MAX_ROUNDS and elapsed * 2 <= budget_ms:
+        rounds += 1
+        elapsed *= 2
+    while rounds > BCRYPT_MIN_ROUNDS and elapsed > budget_ms:
+        rounds -= 1
+        elapsed /= 2
+    if rounds >= floor:
+        elapsed = _measure_rounds(rounds, 1)
+        if elapsed > budget_ms and rounds > floor:
+            rounds -= 1
+            elapsed /= 2
+    else:
+        # The budget is too small for the floor: hash slower instead
+        elapsed *= 2 ** (floor - rounds)
+        rounds = floor
+
+    try:
+        with open(cache_path, "w") as f:
+            json.dump({"host": host, "budget_ms": budget_ms,
+                       "rounds": rounds, "measured_ms": elapsed}, f)
+    except OSError:
+        pass
+    _rounds = rounds
+    return _rounds
+
+
+def bcrypt_rounds() -> int:
+    """Returns the calibrated bcrypt cost, calibrating on first use."""
+    if _rounds is None:
+        return calibrate_rounds()
+    return _rounds
+
+
 def _hash_password(password: str) -> bytes:
-    """Hashes a password using bcrypt."""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    """Hashes a password using bcrypt at the calibrated cost."""
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(bcrypt_rounds()))
 
 
 def _generate_uuid() -> str: